@@ -5,7 +5,8 @@
 
     simple.py is a wrapper for a single-threaded version,     
     threaded.py is a, eh, threaded version,     
-    may be there would also be a "multiprocessed" one.     
+    aio.py is a non-blocking one for an 'asyncore' event loop,
+    multiprocess.py runs the socket I/O in a separate process .     
 
     Some examples will either follow or live in some separate 
     test files here .     
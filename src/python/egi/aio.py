@@ -0,0 +1,433 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    A non-blocking, event-loop based implementation of the "egi.netstation" component .
+
+    The client is an 'asyncore' dispatcher : it does not start any thread of its own and
+    shares the loop ( asyncore.loop() or the poll() / wait() methods below ) with any other
+    dispatchers -- the gaze streaming, the logging, etc. .
+
+    Every command returns a Request right away ; any number of them can be outstanding ,
+    the responses are matched to the commands in the FIFO order .
+
+        ns = Netstation()
+        ns.initialize( '10.0.0.42', 55513 )
+        ns.wait( ns.BeginSession(), timeout = 5 )
+        r = ns.send_event( 'mov1', label = 'movie start' )
+        r.add_done_callback( lambda r : log( r.exception() ) )
+        ...
+        ns.poll() # from the main loop
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import simple as internal # the formats and the codec
+
+import asyncore
+import socket
+import time
+
+from collections import deque
+
+#
+# "forward" these names to be used from outside
+#
+
+Error = internal.Eggog
+ms_localtime = internal.ms_localtime
+SyncPolicy = internal.SyncPolicy
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+class Timeout( internal.Eggog ) :
+    """ the server has not responded to a command in time """
+
+    pass
+
+
+# -----------------------------------------------------------------------------
+
+class Request :
+    """ the outcome of a command : becomes "done" when the response arrives, fails or times out """
+
+    def __init__( self, name, deadline = None ) :
+
+        self.name = name
+        self.deadline = deadline
+
+        self._done = False
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def done( self ) :
+
+        return self._done
+
+    def result( self ) :
+        """ the GetServerResponse()-like result ; raises the error if the command has failed """
+
+        if self._error is not None :
+            raise self._error
+
+        return self._result
+
+    def exception( self ) :
+
+        return self._error
+
+    def add_done_callback( self, fn ) :
+        """ fn( request ) is called when the request is done ( right now, if it already is ) """
+
+        if self._done :
+            fn( self )
+        else :
+            self._callbacks.append( fn )
+
+    ## -----------------------------------------------------------
+
+    def _finish( self, result = None, error = None ) :
+
+        if self._done : return
+
+        self._done = True
+        self._result = result
+        self._error = error
+
+        callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks :
+            fn( self )
+
+
+# -----------------------------------------------------------------------------
+
+class Netstation( asyncore.dispatcher ) :
+
+    """ Provides a non-blocking Python interface for a connection with the Netstation via a TCP/IP socket. """
+
+    ## -----------------------------------------------------------
+
+    def __init__( self, timeout = None, nodelay = False, map = None, sync_policy = None ) :
+        """
+            'timeout' -- the default number of seconds to wait for every response ( None -- forever ) ;
+            'map' -- the asyncore channel map to join ( the global one by default ) ;
+            'sync_policy' -- see clock.SyncPolicy ( None -- every sync() is done ) .
+        """
+
+        asyncore.dispatcher.__init__( self, map = map )
+
+        self._timeout = timeout
+        self._nodelay = nodelay
+
+        self._system_spec = internal._get_endianness_string()
+        self._fmt = internal._Format()
+        self._codec = internal._EventCodec()
+
+        self._out = bytearray()
+        self._in = bytearray()
+
+        # the requests waiting for the response, in the order of sending
+        self._pending = deque()
+
+        self.version = None
+
+        self.sync_policy = sync_policy
+        self._reference = None
+
+    ## -----------------------------------------------------------
+
+    def initialize( self, str_address, port_no ) :
+        """ start connecting ; the commands issued in the meantime are sent once connected """
+
+        self.create_socket( socket.AF_INET, socket.SOCK_STREAM )
+
+        if self._nodelay :
+            self.socket.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+
+        self.connect(  ( str_address, port_no )  )
+
+    def finalize( self, seconds_timeout = 2 ) :
+        """ wait ( up to the timeout ) for the outstanding responses and close the connection """
+
+        deadline = time.time() + seconds_timeout
+
+        while self._pending and time.time() < deadline :
+
+            self.poll( deadline - time.time() )
+
+        self._fail_all( Error( "the connection is closed" ) )
+        self.close()
+
+    ## -----------------------------------------------------------
+
+    def poll( self, timeout = 0.0 ) :
+        """ run one iteration of the loop ( for all the dispatchers of the map ) ; returns no later than the first request deadline """
+
+        deadline = self._next_deadline()
+        if deadline is not None :
+            timeout = max( 0.0, min( timeout, deadline - time.time() ) )
+
+        asyncore.loop( timeout, count = 1, map = self._map )
+        self._check_deadlines()
+
+    def wait( self, request, timeout = None ) :
+        """ run the loop until the request is done ; returns its result ( or raises its error ) """
+
+        if timeout is not None :
+            deadline = time.time() + timeout
+
+        while not request.done() :
+
+            if timeout is None :
+                self.poll( 0.1 )
+                continue
+
+            left = deadline - time.time()
+            if left <= 0 :
+                raise Timeout( "'%s': no response in %s s" % ( request.name, timeout ) )
+
+            self.poll( left )
+
+        return request.result()
+
+    def pending( self ) :
+        """ the number of the commands waiting for the response """
+
+        return len( self._pending )
+
+    ## -----------------------------------------------------------
+
+    def _submit( self, name, message, timeout = None ) :
+        """ queue the message for writing and return the request waiting for its response """
+
+        if timeout is None :
+            timeout = self._timeout
+
+        deadline = None
+        if timeout is not None :
+            deadline = time.time() + timeout
+
+        request = Request( name, deadline )
+
+        self._out += message
+        self._pending.append( request )
+
+        return request
+
+    def _next_deadline( self ) :
+        """ the earliest deadline of the requests still waiting ( None -- no deadline ) """
+
+        deadlines = [ r.deadline for r in self._pending if r.deadline is not None and not r.done() ]
+        if not deadlines : return None
+
+        return min( deadlines )
+
+    def _check_deadlines( self ) :
+        """ fail the requests that have waited for too long """
+
+        if not self._pending : return
+
+        now = time.time()
+
+        # ( the callbacks may send more commands, so don't finish the requests while iterating )
+        expired = [ r for r in self._pending if r.deadline is not None and r.deadline < now and not r.done() ]
+
+        # the request keeps its place in the queue : the late response still has to be matched to it
+        for request in expired :
+            request._finish( error = Timeout( "'%s': no response in time" % ( request.name, ) ) )
+
+    def _fail_all( self, error ) :
+
+        while self._pending :
+            self._pending.popleft()._finish( error = error )
+
+    ## -----------------------------------------------------------
+
+    #
+    # asyncore handlers
+    #
+
+    def readable( self ) :
+
+        # called on every iteration of the loop, whoever runs it -- a good place to check the timeouts
+        self._check_deadlines()
+
+        return True
+
+    def writable( self ) :
+
+        return ( not self.connected ) or len( self._out ) > 0
+
+    def handle_connect( self ) :
+
+        pass
+
+    def handle_write( self ) :
+
+        sent = self.send( self._out )
+        del self._out[ : sent ]
+
+    def handle_read( self ) :
+
+        data = self.recv( 4096 )
+        if not data : return
+
+        # a reply that comes after the deadline must not complete the request that has timed out meanwhile
+        self._check_deadlines()
+
+        self._in += data
+        self._parse()
+
+    def handle_close( self ) :
+
+        self._fail_all( Error( "the connection was closed by the server" ) )
+        self.close()
+
+    def _parse( self ) :
+        """ match the complete responses in the input buffer with the pending requests """
+
+        buf = self._in
+
+        while buf and self._pending :
+
+            code = chr( buf[0] )
+
+            if code == 'Z' :
+
+                size, result, error = 1, True, None
+
+            elif code == 'F' :
+
+                size = 1 + self._fmt.format_length( code )
+                if len( buf ) < size : break
+
+                info = self._fmt.unpack( code, str( buf[ 1 : size ] ) )
+                result, error = False, Error( "server returned an error : " + repr( info ) )
+
+            elif code == 'I' :
+
+                size = 1 + self._fmt.format_length( code )
+                if len( buf ) < size : break
+
+                self.version = self._fmt.unpack( code, str( buf[ 1 : size ] ) )[0]
+                result, error = self.version, None
+
+            else :
+
+                # the stream cannot be trusted any more
+                self._fail_all( Error( "unexpected character code returned from server: '%s'" % ( code, ) ) )
+                del buf[:]
+                self.close()
+
+                return
+
+            del buf[ : size ]
+
+            # ( a request that has timed out is already done -- its late response is just dropped )
+            self._pending.popleft()._finish( result, error )
+
+    ## -----------------------------------------------------------
+
+    def BeginSession( self, timeout = None ) :
+        """ say 'hi!' to the server """
+
+        return self._submit( 'BeginSession', self._fmt.pack( 'Q', self._system_spec ), timeout )
+
+    def EndSession( self, timeout = None ) :
+        """ say 'bye' to the server """
+
+        return self._submit( 'EndSession', 'X', timeout )
+
+    def StartRecording( self, timeout = None ) :
+        """ start recording to the selected ( externally ) file """
+
+        return self._submit( 'StartRecording', 'B', timeout )
+
+    def StopRecording( self, timeout = None ) :
+        """ stop recording to the selected file """
+
+        return self._submit( 'StopRecording', 'E', timeout )
+
+    def SendAttentionCommand( self, timeout = None ) :
+        """ Sends and 'Attention' command """
+
+        return self._submit( 'SendAttentionCommand', 'A', timeout )
+
+    def SendLocalTime( self, ms_time = None, timeout = None ) :
+        """ Send the local time (in ms) to Netstation; usually this happens after an 'Attention' command """
+
+        if ms_time is None :
+            ms_time = ms_localtime()
+
+        return self._submit( 'SendLocalTime', self._fmt.pack( 'T', ms_time ), timeout )
+
+    ## -----------------------------------------------------------
+
+    def sync( self, timestamp = None, timeout = None, force = False ) :
+        """
+            the 'attention' command and the time info, back to back ; the request is done when both are ;
+            with a .sync_policy it is done at once while the last time reference is good enough ( unless forced )
+        """
+
+        request = Request( 'sync' )
+
+        if not force and timestamp is None and self.sync_policy is not None \
+           and not self.sync_policy.due( self._reference, internal.marker_clock.generation ) :
+
+            request._finish( True )
+            return request
+
+        t_sent = internal.marker_clock()
+
+        attention = self.SendAttentionCommand( timeout )
+        local_time = self.SendLocalTime( timestamp, timeout )
+
+        def _done( r ) :
+
+            error = attention.exception() or local_time.exception()
+            if error is not None :
+                request._finish( error = Error( "sync command failed! (%s)" % ( error, ) ) )
+            else :
+                # ( the time is taken no earlier than t_sent )
+                self._reference = internal.TimeReference( internal.monotonic(), internal.marker_clock.generation,
+                                                          internal.marker_clock() - t_sent )
+                request._finish( True )
+
+        # the time command is answered after the attention one
+        local_time.add_done_callback( _done )
+
+        return request
+
+    ## -----------------------------------------------------------
+
+    def send_event( self, key, timestamp = None, label = None, description = None, table = None, pad = False, timeout = None ) :
+        """ Send an event ( see egi.simple.Netstation.send_event() for the arguments ) """
+
+        message = self._codec.pack( key, timestamp, label, description, table, pad )
+
+        return self._submit( 'send_event', message, timeout )
+
+    def send_template( self, template, timestamp = None, timeout = None ) :
+        """ Send a pre-encoded event ( see event_template() ) """
+
+        return self._submit( 'send_template', template.stamp( timestamp ), timeout )
+
+    def event_template( self, key, label = None, description = None, table = None, pad = False ) :
+        """ Pre-encode an event to be sent with send_template() """
+
+        return internal.EventTemplate( key, label, description, table, pad, self._codec )
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    print "module dir() listing: ", dir()
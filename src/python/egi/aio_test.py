@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+    The per-request timeouts of the egi.aio client, against a slow stand-in server ( egi.mock_server ) .
+
+    usage : python -m egi.aio_test
+
+"""
+
+import time
+
+import aio
+
+from mock_server import MockNetstation
+
+# -----------------------------------------------------------------------------
+
+def _connect( server ) :
+
+    ns = aio.Netstation()
+    ns.initialize( *server.address )
+    ns.wait( ns.BeginSession(), timeout = 5 )
+
+    return ns
+
+
+def test_wait_times_out_before_the_late_reply() :
+    """ wait() with a longer timeout of its own gives up at the request deadline, not when the reply comes """
+
+    server = MockNetstation( latency = 0.3 )
+    server.start()
+
+    ns = _connect( server )
+    try :
+        t0 = time.time()
+        request = ns.send_event( 'evt1', timeout = 0.05 )
+
+        try :
+            ns.wait( request, timeout = 1.0 )
+        except aio.Timeout :
+            pass
+        else :
+            assert False, "no Timeout raised"
+
+        elapsed = time.time() - t0
+        assert elapsed < 0.15, "timed out after %.3f s" % ( elapsed, )
+
+        # the late reply is matched to the request but does not complete it again
+        while ns.pending() :
+            ns.poll( 0.1 )
+
+        assert isinstance( request.exception(), aio.Timeout )
+
+    finally :
+        ns.finalize()
+        server.stop()
+
+
+def test_late_reply_does_not_complete_an_expired_request() :
+    """ a reply read after the deadline has passed ( the loop blocked elsewhere ) still leaves the request timed out """
+
+    server = MockNetstation( latency = 0.1 )
+    server.start()
+
+    ns = _connect( server )
+    try :
+        request = ns.send_event( 'evt1', timeout = 0.05 )
+        ns.poll( 0.0 ) # write the command
+
+        time.sleep( 0.3 ) # the reply is already waiting in the socket
+
+        # ( readable() is skipped to let handle_read() see the reply first )
+        ns.handle_read()
+
+        assert isinstance( request.exception(), aio.Timeout )
+
+    finally :
+        ns.finalize()
+        server.stop()
+
+
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    for test in ( test_wait_times_out_before_the_late_reply, test_late_reply_does_not_complete_an_expired_request ) :
+
+        test()
+        print " egi: %s ok " % ( test.__name__, )
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+    A microbenchmark for the event encoders : the original _DataFormat.pack()
+    against the compiled _EventCodec.pack() .
+
+    Before timing anything the two encoders are checked to produce
+    exactly the same bytes for every sample event .
+
+    usage : python -m egi.bench_codec [ number_of_calls ]
+
+"""
+
+import sys
+import timeit
+
+import simple as internal
+
+# -----------------------------------------------------------------------------
+
+#
+# events shaped like the ones sent by the experiments
+#
+
+SAMPLES = \
+[ ( 'simple', ( 'mov2', 1000, 'movie end', None, {} ) ),
+  ( 'block', ( 'blk1', 1000, 'block start', None, { 'code' : 'happy' } ) ),
+  ( 'movie', ( 'mov1', 1000, 'movie start', None, { 'code' : 'happy', 'mvmt' : 'mouth', 'actr' : 'F01' } ) ),
+  ( 'mixed', ( 'att1', 1000, 'attn stim', 'description', { 'trla' : 7, 'gaze' : True, 'dist' : 1.5, 'code' : 'cong' } ) ),
+]
+
+# -----------------------------------------------------------------------------
+
+def check( legacy, codec ) :
+    """ make sure the encoders agree byte-for-byte """
+
+    for name, args in SAMPLES :
+
+        expected = legacy.pack( *args )
+        result = codec.pack( *args )
+
+        if result != expected :
+
+            raise internal.Eggog( "'%s': the encoders disagree : %r != %r" % ( name, result, expected ) )
+
+
+def run( number = 100000 ) :
+    """ time both encoders on every sample, print the calls per second and the speed-up """
+
+    legacy = internal._DataFormat()
+    codec = internal._EventCodec()
+
+    check( legacy, codec )
+
+    print "%-8s %14s %14s %8s" % ( 'event', 'legacy, us', 'codec, us', 'ratio' )
+
+    for name, args in SAMPLES :
+
+        t_legacy = min( timeit.repeat( lambda : legacy.pack( *args ), number = number, repeat = 3 ) )
+        t_codec = min( timeit.repeat( lambda : codec.pack( *args ), number = number, repeat = 3 ) )
+
+        us_legacy = 1e6 * t_legacy / number
+        us_codec = 1e6 * t_codec / number
+
+        print "%-8s %14.2f %14.2f %7.1fx" % ( name, us_legacy, us_codec, t_legacy / t_codec )
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    if len( sys.argv ) > 1 :
+        run( int( sys.argv[1] ) )
+    else :
+        run()
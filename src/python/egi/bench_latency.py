@@ -0,0 +1,290 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+    An end-to-end marker benchmark for the simple, threaded ( with the default queue, with
+    the ring, see threaded._Ring, and with the 'latency' and 'throughput' transport profiles ,
+    see socket_wrapper.PROFILES ) and threaded_alt clients ,
+    run against the local stand-in server ( egi.mock_server ) .
+
+    Two workloads :
+
+        burst     -- trial-like : a sync, then a burst of events, repeated ;
+        sustained -- events sent at a fixed rate ( or as fast as possible, rate 0 ) .
+
+    For every event the time from the send_event() call ( "enqueue" ) to the moment
+    the client has read the acknowledgement is measured ; the report gives the events
+    per second and the 50 / 95 / 99th percentiles of that latency .
+
+    usage : python -m egi.bench_latency [ latency_ms [ events [ rate ] ] ]
+
+"""
+
+import sys
+import time
+
+import simple
+import threaded
+import threaded_alt
+
+from mock_server import MockNetstation
+
+# -----------------------------------------------------------------------------
+
+TABLE = { 'code' : 'happy', 'mvmt' : 'mouth', 'actr' : 'F01' }
+
+# -----------------------------------------------------------------------------
+
+def percentile( sorted_values, p ) :
+    """ the p-th percentile of an already sorted list """
+
+    if not sorted_values :
+        return float( 'nan' )
+
+    i = int( round( p / 100.0 * ( len( sorted_values ) - 1 ) ) )
+
+    return sorted_values[ i ]
+
+
+def _record_acks( obj, name, acks ) :
+    """ replace the method of the given ( inner, blocking ) Netstation object by one that notes the time of the ack """
+
+    method = getattr( obj, name )
+
+    def timed( *args, **kwargs ) :
+
+        result = method( *args, **kwargs )
+        acks.append( time.time() )
+
+        return result
+
+    setattr( obj, name, timed )
+
+
+# -----------------------------------------------------------------------------
+
+#
+# a uniform "driver" around every client variant
+#
+
+class _SimpleDriver :
+
+    name = 'simple'
+
+    def __init__( self, address ) :
+
+        self.acks = []
+
+        self.ns = simple.Netstation()
+        self.ns.connect( *address )
+        self.ns.BeginSession()
+
+        _record_acks( self.ns, 'send_event', self.acks )
+
+    def sync( self ) :
+        self.ns.sync()
+
+    def send_event( self, key, table ) :
+        self.ns.send_event( key, label = 'bench', table = table )
+
+    def wait( self, n_acks ) :
+        pass # the calls block
+
+    def close( self ) :
+        self.ns.EndSession()
+        self.ns.disconnect()
+
+
+class _ThreadedDriver :
+
+    name = 'threaded'
+    module = threaded
+
+    # the Netstation() arguments
+    options = {}
+
+    def __init__( self, address ) :
+
+        self.acks = []
+
+        self.ns = self.module.Netstation( **self.options )
+        self.ns.initialize( *address )
+        self.ns.BeginSession()
+
+        _record_acks( self.ns._netstation_thread._netstation_object, 'send_event', self.acks )
+
+    def sync( self ) :
+        self.ns.sync()
+
+    def send_event( self, key, table ) :
+        self.ns.send_event( key, label = 'bench', table = table )
+
+    def wait( self, n_acks ) :
+
+        while len( self.acks ) < n_acks :
+            time.sleep( 0.0005 )
+
+    def close( self ) :
+        self.ns.EndSession()
+        self.ns.finalize( 10 ) # returns as soon as the thread is done
+
+
+class _ThreadedRingDriver( _ThreadedDriver ) :
+
+    name = 'threaded_ring'
+    options = { 'ring_size' : 1024 }
+
+
+#
+# the transport profiles ( see socket_wrapper.PROFILES ) ; with the 'throughput' one the events
+# go out in batches ( send_events() ), so their acks are recorded there as well
+#
+
+class _LatencyProfileDriver( _ThreadedDriver ) :
+
+    name = 'latency'
+    options = { 'profile' : 'latency' }
+
+
+class _ThroughputProfileDriver( _ThreadedDriver ) :
+
+    name = 'throughput'
+    options = { 'profile' : 'throughput' }
+
+    def __init__( self, address ) :
+
+        _ThreadedDriver.__init__( self, address )
+
+        acks = self.acks
+        obj = self.ns._netstation_thread._netstation_object
+        method = obj.send_events
+
+        def timed( events ) :
+
+            results = method( events )
+            acks.extend( [ time.time() ] * len( events ) )
+
+            return results
+
+        obj.send_events = timed
+
+
+class _ThreadedAltDriver( _ThreadedDriver ) :
+
+    name = 'threaded_alt'
+    module = threaded_alt
+
+    def close( self ) :
+        self.ns.EndSession()
+        self.ns.finalize( 0 ) # this one spins for the whole timeout
+        self.ns._netstation_thread.join()
+
+
+DRIVERS = [ _SimpleDriver, _ThreadedDriver, _ThreadedRingDriver, _LatencyProfileDriver, _ThroughputProfileDriver, _ThreadedAltDriver ]
+
+# -----------------------------------------------------------------------------
+
+def burst( driver, n_events, burst_size = 10 ) :
+    """ sync, then 'burst_size' events, until 'n_events' have been sent ; returns the enqueue times """
+
+    enqueued = []
+
+    while len( enqueued ) < n_events :
+
+        driver.sync()
+
+        for i in xrange( min( burst_size, n_events - len( enqueued ) ) ) :
+
+            enqueued.append( time.time() )
+            driver.send_event( 'mov1', TABLE )
+
+        # a short "inter-trial" pause for the threaded clients to catch up
+        driver.wait( len( enqueued ) )
+
+    return enqueued
+
+
+def sustained( driver, n_events, rate = 0 ) :
+    """ 'n_events' events at 'rate' per second ( as fast as possible for 0 ) ; returns the enqueue times """
+
+    enqueued = []
+
+    period = 0
+    if rate > 0 :
+        period = 1.0 / rate
+
+    t_start = time.time()
+
+    for i in xrange( n_events ) :
+
+        if period :
+            wait = t_start + i * period - time.time()
+            if wait > 0 :
+                time.sleep( wait )
+
+        enqueued.append( time.time() )
+        driver.send_event( 'mov1', TABLE )
+
+    driver.wait( n_events )
+
+    return enqueued
+
+
+WORKLOADS = [ ( 'burst', burst ), ( 'sustained', sustained ) ]
+
+# -----------------------------------------------------------------------------
+
+def report( driver_name, workload_name, enqueued, acks ) :
+    """ print one line of the results """
+
+    latencies = sorted( ack - enq for enq, ack in zip( enqueued, acks ) )
+
+    elapsed = acks[-1] - enqueued[0]
+    rate = len( acks ) / elapsed
+
+    print "%-13s %-10s %8d %10.0f %9.3f %9.3f %9.3f" % \
+          ( driver_name, workload_name, len( acks ), rate,
+            1000 * percentile( latencies, 50 ),
+            1000 * percentile( latencies, 95 ),
+            1000 * percentile( latencies, 99 ) )
+
+
+def run( latency = 0.0005, n_events = 2000, rate = 0, jitter = 0.0 ) :
+    """ run every workload for every client variant against a fresh server """
+
+    print "server latency %.3f ms, jitter %.3f ms, %d events per run" % ( 1000 * latency, 1000 * jitter, n_events )
+    print "%-13s %-10s %8s %10s %9s %9s %9s" % ( 'client', 'workload', 'events', 'events/s', 'p50, ms', 'p95, ms', 'p99, ms' )
+
+    for driver_class in DRIVERS :
+
+        for workload_name, workload in WORKLOADS :
+
+            server = MockNetstation( latency = latency, jitter = jitter, seed = 0 )
+            server.start()
+
+            driver = driver_class( server.address )
+
+            if workload is sustained :
+                enqueued = workload( driver, n_events, rate )
+            else :
+                enqueued = workload( driver, n_events )
+
+            acks = list( driver.acks )
+            driver.close()
+            server.stop()
+
+            report( driver.name, workload_name, enqueued, acks )
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    args = sys.argv[1:] + [ None ] * 3
+
+    latency = float( args[0] or 0.5 ) / 1000
+    n_events = int( args[1] or 2000 )
+    rate = float( args[2] or 0 )
+
+    run( latency, n_events, rate )
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+    A benchmark for the 'to-send' queue between the experiment thread and the
+    'postman' thread of egi.threaded : the two-lane _LaneQueue ( the default ) and
+    the single-producer / single-consumer _Ring .
+
+    end to end -- ns.send_event() against the local stand-in server ( egi.mock_server ) :
+                  the cost of the call on the experiment thread ( the command and its Request ,
+                  the timestamp, the put() ) and the events per second acknowledged ;
+    put() alone -- one thread puts pre-made commands, another one takes them ( and does
+                  nothing else ) ; the plain Queue.Queue is timed as well, for comparison .
+
+    The end-to-end queues do not fill up ( _LaneQueue is unbounded, the ring has a slot for
+    every event ), so the call is never kept waiting for room ; the experiments bound
+    _LaneQueue ( capacity = 1000, overflow = 'spill' ), and this is the path their markers take
+    while the queue is below that capacity .
+
+    The server runs in the same process, so the postman and the server threads compete with
+    the caller for the interpreter lock . On a 2.7 / Linux box, 20000 events, the best of 3 runs :
+
+        queue          send_event, us    events/s    put() alone, us
+        _LaneQueue         21 - 25       11000 - 13000     2 - 5
+        _Ring              21 - 24       11000 - 12800     1 - 1.5
+
+    -- the put() is a small part of a send_event() ( the command, its Request, the timestamp ,
+    the other threads ) : end to end the two queues cannot be told apart .
+
+    usage : python -m egi.bench_queue [ number_of_commands [ size [ number_of_events ] ] ]
+
+"""
+
+import sys
+import time
+
+from Queue import Queue
+from threading import Thread
+
+import threaded
+
+from mock_server import MockNetstation
+
+# -----------------------------------------------------------------------------
+
+def _consume( queue, n_commands, done ) :
+    """ take the commands and the end marker ; note the time of the last one """
+
+    for i in xrange( n_commands + 1 ) :
+        queue.get()
+
+    done.append( time.time() )
+
+
+def measure( queue, n_commands ) :
+    """ push 'n_commands' pre-made commands through the queue ; returns ( commands per second, us per put ) """
+
+    packets = [ threaded._Command( 'send_event', { 'key' : 'mov1', 'timestamp' : i } ) for i in xrange( n_commands ) ]
+
+    done = []
+    consumer = Thread( target = _consume, args = ( queue, n_commands, done ) )
+    consumer.start()
+
+    put = queue.put
+    spent = 0.0
+
+    t_start = time.time()
+
+    for packet in packets :
+
+        t = time.time()
+        put( packet )
+        spent += time.time() - t
+
+    put( None )
+    consumer.join()
+
+    return n_commands / ( done[0] - t_start ), 1e6 * spent / n_commands
+
+
+def measure_send_event( options, n_events ) :
+    """ send 'n_events' events through a Netstation( **options ) ; returns ( us per send_event(), events per second ) """
+
+    server = MockNetstation()
+    server.start()
+
+    ns = threaded.Netstation( **options )
+    ns.initialize( *server.address )
+    ns.BeginSession().wait()
+
+    send_event = ns.send_event
+    table = { 'code' : 'happy' }
+
+    t_start = time.time()
+
+    for i in xrange( n_events ) :
+        request = send_event( 'mov1', label = 'bench', table = table )
+
+    spent = time.time() - t_start
+
+    request.wait()
+    rate = n_events / ( time.time() - t_start )
+
+    ns.EndSession()
+    ns.finalize( 10 )
+    server.stop()
+
+    return 1e6 * spent / n_events, rate
+
+
+def run( n_commands = 200000, size = 1024, n_events = 20000 ) :
+    """ time send_event() end to end, then the put() of every queue, bounded to 'size' commands or not """
+
+    print "send_event() end to end, %d events, the best of 3 runs" % ( n_events, )
+    print "%-20s %14s %12s" % ( 'queue', 'send_event, us', 'events/s' )
+
+    for name, options in [ ( '_LaneQueue', {} ), ( '_Ring', { 'ring_size' : n_events + 16 } ) ] :
+
+        # ( the best of 3 runs : the other threads make it noisy )
+        runs = [ measure_send_event( options, n_events ) for i in xrange( 3 ) ]
+
+        cost, rate = min( c for c, r in runs ), max( r for c, r in runs )
+
+        print "%-20s %14.1f %12.0f" % ( name, cost, rate )
+
+    print
+    print "put() alone, %d commands, bounded to %d ( _LaneQueue unbounded, see above )" % ( n_commands, size )
+
+    queues = [ ( 'Queue', lambda : Queue() ),
+               ( 'Queue, bounded', lambda : Queue( size ) ),
+               ( '_LaneQueue', lambda : threaded._LaneQueue() ),
+               ( '_Ring', lambda : threaded._Ring( size ) ) ]
+
+    print "%-20s %12s %12s" % ( 'queue', 'commands/s', 'put, us' )
+
+    for name, make in queues :
+
+        rate, cost = measure( make(), n_commands )
+
+        print "%-20s %12.0f %12.3f" % ( name, rate, cost )
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    args = sys.argv[1:] + [ None ] * 3
+
+    n_commands = int( args[0] or 200000 )
+    size = int( args[1] or 1024 )
+    n_events = int( args[2] or 20000 )
+
+    run( n_commands, size, n_events )
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+    The clock for the marker timestamps .
+
+    Netstation only needs the timestamps of the events to come from the same clock
+    as the time sent by sync() ; they are 32-bit milliseconds . A monotonic source is
+    used, so the markers are not affected by the wall clock being adjusted, and the
+    milliseconds are counted from a "session epoch" -- the moment the clock was created .
+
+"""
+
+import sys
+import time
+
+# -----------------------------------------------------------------------------
+
+#
+# a monotonic, high-resolution source of seconds ( the origin does not matter )
+#
+
+def _linux_monotonic() :
+    """ clock_gettime( CLOCK_MONOTONIC ) through ctypes """
+
+    import ctypes, ctypes.util
+
+    class timespec( ctypes.Structure ) :
+        _fields_ = [ ( 'tv_sec', ctypes.c_long ), ( 'tv_nsec', ctypes.c_long ) ]
+
+    CLOCK_MONOTONIC = 1 # <linux/time.h>
+
+    library = ctypes.util.find_library( 'rt' ) or ctypes.util.find_library( 'c' )
+    clock_gettime = ctypes.CDLL( library, use_errno = True ).clock_gettime
+    clock_gettime.argtypes = [ ctypes.c_int, ctypes.POINTER( timespec ) ]
+
+    t = timespec()
+    t_ref = ctypes.byref( t )
+
+    def monotonic() :
+
+        if clock_gettime( CLOCK_MONOTONIC, t_ref ) != 0 :
+            raise OSError( ctypes.get_errno(), "clock_gettime() failed" )
+
+        return t.tv_sec + t.tv_nsec * 1e-9
+
+    return monotonic
+
+
+def _pick_monotonic() :
+
+    if hasattr( time, 'monotonic' ) :
+        return time.monotonic
+
+    if sys.platform == 'win32' :
+        # QueryPerformanceCounter() based, counts from the first call
+        return time.clock
+
+    if sys.platform.startswith( 'linux' ) :
+        try :
+            return _linux_monotonic()
+        except ( OSError, AttributeError, TypeError ) :
+            pass
+
+    # nothing better available : the wall clock
+    return time.time
+
+
+monotonic = _pick_monotonic()
+
+# -----------------------------------------------------------------------------
+
+class MarkerClock :
+    """
+        32-bit millisecond timestamps relative to the session epoch .
+
+        The counter lasts for 2^32 ms ( ~49.7 days ) ; when it runs out, the epoch is moved
+        to the current moment and the 'generation' is increased, so the clients know
+        they have to sync() again before sending more events .
+    """
+
+    limit = 0xFFFFFFFF
+
+    def __init__( self, source = None ) :
+
+        if source is None : source = monotonic
+
+        self._source = source
+        self.generation = 0
+        self.reset()
+
+    def reset( self ) :
+        """ start counting from zero, now """
+
+        self._epoch = self._source()
+
+    def align( self, ms, generation = 0 ) :
+        """ move the epoch so that the clock reads 'ms' now ( to share one clock between processes ) """
+
+        self._epoch = self._source() - ms / 1000.0
+        self.generation = generation
+
+    def __call__( self ) :
+        """ the milliseconds since the epoch """
+
+        ms = int( ( self._source() - self._epoch ) * 1000 )
+
+        if ms > self.limit :
+
+            self.reset()
+            self.generation += 1
+            ms = 0
+
+        return ms
+
+    def seconds( self, ms ) :
+        """ convert a timestamp of the current generation back to the source seconds """
+
+        return self._epoch + ms / 1000.0
+
+# -----------------------------------------------------------------------------
+
+class TimeReference :
+    """ the last sync : when ( the monotonic seconds ), in which clock generation, and how well ( ms, None -- unknown ) """
+
+    def __init__( self, time, generation, uncertainty = None ) :
+
+        self.time = time
+        self.generation = generation
+        self.uncertainty = uncertainty
+
+
+class SyncPolicy :
+    """
+        decides whether a sync() is needed or the last time reference is still good enough .
+
+        The clocks of the two machines run at slightly different rates, so the error of the
+        reference grows with the time since the sync :  uncertainty + elapsed * drift .
+        A sync is due when this bound exceeds the 'tolerance', after 'max_interval' seconds
+        anyway, when the quality of the last sync is unknown or the marker clock has started
+        a new generation .
+    """
+
+    def __init__( self, tolerance = 2.0, drift_ppm = 100.0, max_interval = 60.0 ) :
+        """
+            'tolerance' -- the acceptable error of the reference, ms ;
+            'drift_ppm' -- the bound of the rate difference of the clocks, in parts per million
+                           ( 100 for the two usual +/- 50 ppm crystals ) ;
+            'max_interval' -- the longest time between the syncs, seconds .
+        """
+
+        self.tolerance = tolerance
+        self.drift_ppm = drift_ppm
+        self.max_interval = max_interval
+
+    def error_bound( self, reference, now = None ) :
+        """ the largest error of the reference now, ms ( None if unknown ) """
+
+        if reference is None or reference.uncertainty is None :
+            return None
+
+        if now is None : now = monotonic()
+
+        return reference.uncertainty + ( now - reference.time ) * 1000 * self.drift_ppm * 1e-6
+
+    def due( self, reference, generation, now = None ) :
+
+        if reference is None or reference.generation != generation :
+            return True
+
+        if now is None : now = monotonic()
+
+        if now - reference.time >= self.max_interval :
+            return True
+
+        bound = self.error_bound( reference, now )
+
+        return bound is None or bound > self.tolerance
@@ -0,0 +1,248 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+    A binary journal of the Netstation traffic, and the tools to read and to replay it .
+
+    The journal is written by socket_wrapper.Socket ( see Socket.capture() ) : every chunk
+    written to the socket and every chunk received from it is appended as a record
+
+        direction ( '>' out, '<' in ) , time ( monotonic seconds, "=d" ) , size ( "=L" ) , bytes
+
+    after a file header with the wall-clock and the monotonic time of the start .
+
+    decode() turns a journal back into the commands and the responses ( the 'D' messages
+    are decoded into events ), replay() sends the recorded commands to any ECI server --
+    as fast as possible, or keeping the original timing ( optionally sped up ) .
+
+    usage : python -m egi.journal dump journal_file
+            python -m egi.journal replay journal_file host port [ speed ]    ( no speed -- as fast as possible )
+
+"""
+
+import struct
+import sys
+import time
+
+from clock import monotonic
+
+# -----------------------------------------------------------------------------
+
+MAGIC = 'EGIJ'
+VERSION = 1
+
+_file_header = struct.Struct( '=4sBdd' ) # magic, version, wall-clock time, monotonic time
+_record_header = struct.Struct( '=cdL' ) # direction, monotonic time, size
+
+OUT = '>'
+IN = '<'
+
+# -----------------------------------------------------------------------------
+
+class Journal :
+    """ appends the records to a file ; the file is buffered, so the cost per record is small """
+
+    def __init__( self, path ) :
+
+        self._file = open( path, 'wb' )
+        self._file.write( _file_header.pack( MAGIC, VERSION, time.time(), monotonic() ) )
+
+    def record( self, direction, data ) :
+
+        self._file.write( _record_header.pack( direction, monotonic(), len( data ) ) )
+        self._file.write( data )
+
+    def flush( self ) :
+
+        self._file.flush()
+
+    def close( self ) :
+
+        self._file.close()
+
+
+def read_records( path ) :
+    """ yields ( direction, time, bytes ) ; the time is in seconds from the start of the journal """
+
+    f = open( path, 'rb' )
+
+    try :
+
+        header = f.read( _file_header.size )
+        magic, version, wall_start, mono_start = _file_header.unpack( header )
+
+        if magic != MAGIC :
+            raise ValueError( "'%s' is not a Netstation journal" % ( path, ) )
+
+        while True :
+
+            header = f.read( _record_header.size )
+            if len( header ) < _record_header.size : break
+
+            direction, t, size = _record_header.unpack( header )
+            data = f.read( size )
+            if len( data ) < size : break # the journal was cut
+
+            yield direction, t - mono_start, data
+
+    finally :
+        f.close()
+
+
+# -----------------------------------------------------------------------------
+
+#
+# splitting the streams into the messages
+#
+
+# the number of bytes following the command / response code ( 'D' has its own size field )
+_command_sizes = { 'Q' : 4, 'T' : 4, 'X' : 0, 'B' : 0, 'E' : 0, 'A' : 0 }
+_response_sizes = { 'Z' : 0, 'F' : 4, 'I' : 1 }
+
+
+def _split( data, sizes ) :
+    """ split a chunk into the complete messages ; returns the messages and the incomplete rest """
+
+    messages = []
+    offset = 0
+
+    while offset < len( data ) :
+
+        code = data[ offset ]
+
+        if code == 'D' :
+            if offset + 3 > len( data ) : break
+            size = 3 + struct.unpack( '=H', data[ offset + 1 : offset + 3 ] )[0]
+        else :
+            size = 1 + sizes.get( code, 0 )
+
+        if offset + size > len( data ) : break
+
+        messages.append( data[ offset : offset + size ] )
+        offset += size
+
+    return messages, data[ offset : ]
+
+
+def messages( path ) :
+    """ yields ( direction, time, message ) -- the records split into the single commands / responses """
+
+    rest = { OUT : '', IN : '' }
+    sizes = { OUT : _command_sizes, IN : _response_sizes }
+
+    for direction, t, data in read_records( path ) :
+
+        split, rest[ direction ] = _split( rest[ direction ] + data, sizes[ direction ] )
+
+        for message in split :
+            yield direction, t, message
+
+
+def decode_message( message ) :
+    """ the code and the decoded contents of a single message """
+
+    # ( imported here : the mock server module is not needed for capturing )
+    from mock_server import decode_event
+
+    code = message[0]
+
+    if code == 'D' :
+        return code, decode_event( message[3:] )
+
+    if code == 'T' :
+        return code, struct.unpack( '=L', message[1:] )[0]
+
+    if code == 'I' :
+        return code, struct.unpack( '=B', message[1:] )[0]
+
+    return code, message[1:] or None
+
+
+def decode( path ) :
+    """ the whole journal as a list of ( time, direction, code, contents ) """
+
+    result = []
+
+    for direction, t, message in messages( path ) :
+
+        code, contents = decode_message( message )
+        result.append( ( t, direction, code, contents ) )
+
+    return result
+
+
+# -----------------------------------------------------------------------------
+
+def replay( path, str_address, port_no, speed = None, window = 64 ) :
+    """
+        send the recorded commands to the given server ;
+        'speed' -- None for "as fast as possible", 1.0 for the original timing, 2.0 for twice faster etc. ;
+        returns a summary : the numbers of the commands, the failures and the elapsed time .
+    """
+
+    import simple
+
+    ns = simple.Netstation()
+    ns.connect( str_address, port_no )
+    ns.pipeline( window )
+
+    n_sent = 0
+    results = []
+    t_first = None
+    t_start = monotonic()
+
+    for direction, t, message in messages( path ) :
+
+        if direction != OUT : continue
+
+        if speed :
+
+            if t_first is None : t_first = t
+
+            wait = t_start + ( t - t_first ) / speed - monotonic()
+            if wait > 0 :
+                results.extend( ns.collect_responses() )
+                time.sleep( wait )
+
+        ns._command( message[0], message )
+        n_sent += 1
+
+    results.extend( ns.end_pipeline() )
+    elapsed = monotonic() - t_start
+
+    ns.disconnect()
+
+    failed = [ r for r in results if isinstance( r[1], simple.Eggog ) ]
+
+    return { 'sent' : n_sent,
+             'responses' : len( results ),
+             'failed' : len( failed ),
+             'elapsed' : elapsed,
+             'rate' : n_sent / elapsed if elapsed > 0 else float( 'inf' ) }
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    if len( sys.argv ) < 3 or sys.argv[1] not in ( 'dump', 'replay' ) :
+
+        print __doc__
+        sys.exit( 1 )
+
+    if sys.argv[1] == 'dump' :
+
+        for t, direction, code, contents in decode( sys.argv[2] ) :
+            print "%12.6f %s %s %r" % ( t, direction, code, contents )
+
+    else :
+
+        speed = None
+        if len( sys.argv ) > 5 :
+            speed = float( sys.argv[5] )
+
+        summary = replay( sys.argv[2], sys.argv[3], int( sys.argv[4] ), speed )
+
+        print "%(sent)d commands sent, %(responses)d responses, %(failed)d failed, " \
+              "%(elapsed).3f s, %(rate).0f commands/s" % summary
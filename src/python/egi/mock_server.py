@@ -0,0 +1,401 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    A stand-in for the Netstation "Experimental Control Interface" server ,
+    to run the egi clients without the real thing ( tests, benchmarks, debugging ) .
+
+    It speaks the same subset of the protocol the clients implement :
+    'Q' ( answered with 'I' and the version ), 'X', 'B', 'E', 'A', 'T' and the 'D' events
+    with their key / value tables ; everything else is answered with 'Z' or 'F' .
+    Every command is recorded, decoded, with the time of its arrival .
+
+    Artificial latency, jitter and errors can be injected ; the responses are delayed
+    without slowing down the reading, so the server behaves like a remote one .
+
+        server = MockNetstation( latency = 0.002, jitter = 0.001 )
+        server.start()
+        ns.connect( *server.address )
+        ...
+        server.stop()
+        print server.events
+
+    usage : python -m egi.mock_server [ port [ latency_ms [ jitter_ms [ error_rate ] ] ] ]
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import simple as internal # the formats
+
+import random
+import select
+import socket
+import struct
+import sys
+import time
+
+from threading import Thread, Lock
+from Queue import Queue
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+class Command :
+    """ a command received by the server : the code, the time of arrival and the decoded contents """
+
+    def __init__( self, code, arrival, data = None ) :
+
+        self.code = code
+        self.arrival = arrival
+        self.data = data
+
+        self.response = None
+
+    def __repr__( self ) :
+
+        return "Command(%r, %.6f, %r)" % ( self.code, self.arrival, self.data )
+
+
+class Event :
+    """ a decoded 'D' message """
+
+    def __init__( self, key, timestamp, duration, label, description, table, arrival ) :
+
+        self.key = key
+        self.timestamp = timestamp
+        self.duration = duration
+        self.label = label
+        self.description = description
+        self.table = table
+        self.arrival = arrival
+
+    def __repr__( self ) :
+
+        return "Event(%r, %d, %r, %r, %r)" % ( self.key, self.timestamp, self.label, self.description, self.table )
+
+
+# -----------------------------------------------------------------------------
+
+#
+# decoding the 'D' messages ( the reverse of simple._DataFormat.pack() )
+#
+
+# 'DescType' -> 'struct' format, the texts are kept as they are
+_value_formats = dict( hints for hints in internal._DataFormat()._translation_table.values() if hints[0] != 'TEXT' )
+
+def decode_event( body, arrival = None ) :
+    """ decode the part of a 'D' message that follows the size field """
+
+    timestamp, duration, key = struct.unpack_from( '=2L4s', body )
+    offset = struct.calcsize( '=2L4s' )
+
+    # label and description : Pascal strings
+    strings = []
+    for i in xrange( 2 ) :
+
+        if offset >= len( body ) :
+            strings.append( '' )
+            continue
+
+        n = ord( body[ offset ] )
+        strings.append( body[ offset + 1 : offset + 1 + n ] )
+        offset += 1 + n
+
+    label, description = strings
+
+    table = {}
+    if offset < len( body ) :
+
+        nkeys = ord( body[ offset ] )
+        offset += 1
+
+        for i in xrange( nkeys ) :
+
+            k, desctype, length = struct.unpack_from( '=4s4sH', body, offset )
+            offset += struct.calcsize( '=4s4sH' )
+
+            data = body[ offset : offset + length ]
+            offset += length
+
+            fmt = _value_formats.get( desctype )
+            if fmt is not None :
+                table[ k ] = struct.unpack( fmt, data )[0]
+            else :
+                table[ k ] = data
+
+    return Event( key, timestamp, duration, label, description, table, arrival )
+
+
+# -----------------------------------------------------------------------------
+
+class _Connection( Thread ) :
+
+    """ reads and decodes the commands of one client ; the responses go out from another thread """
+
+    def __init__( self, server, sock ) :
+
+        Thread.__init__( self )
+
+        self.setName( "Mock Netstation Connection" )
+        self.setDaemon( True )
+
+        self._server = server
+        self._socket = sock
+        self._stream = sock.makefile( 'rb' )
+
+        self._responses = Queue()
+        self._writer = Thread( target = self._write_responses, name = "Mock Netstation Responder" )
+        self._writer.setDaemon( True )
+
+        # the responses can be delayed, but never reordered
+        self._last_due = 0.0
+
+    ## -----------------------------------------------------------
+
+    def run( self ) :
+
+        self._writer.start()
+
+        try :
+            while self._serve_one() :
+                pass
+        finally :
+            self._responses.put( None )
+
+    def _read( self, size ) :
+
+        data = self._stream.read( size )
+        if len( data ) < size :
+            raise EOFError()
+
+        return data
+
+    def _serve_one( self ) :
+        """ read, record and answer one command ; False when the client has gone """
+
+        try :
+            code = self._read( 1 )
+        except ( EOFError, socket.error ) :
+            return False
+
+        arrival = time.time()
+
+        try :
+
+            if code == 'Q' :
+                command = Command( code, arrival, self._read( 4 ) )
+
+            elif code == 'T' :
+                command = Command( code, arrival, struct.unpack( '=L', self._read( 4 ) )[0] )
+
+            elif code == 'D' :
+                size = struct.unpack( '=H', self._read( 2 ) )[0]
+                command = Command( code, arrival, decode_event( self._read( size ), arrival ) )
+
+            else :
+                command = Command( code, arrival )
+
+        except ( EOFError, socket.error ) :
+            return False
+
+        command.response = self._server._respond( command )
+        self._server._record( command )
+
+        delay = self._server._delay()
+        due = max( self._last_due, arrival + delay )
+        self._last_due = due
+
+        self._responses.put( ( due, command.response ) )
+
+        return code != 'X'
+
+    def _write_responses( self ) :
+
+        while True :
+
+            item = self._responses.get()
+            if item is None : break
+
+            due, response = item
+
+            wait = due - time.time()
+            if wait > 0 :
+                time.sleep( wait )
+
+            try :
+                self._socket.sendall( response )
+            except socket.error :
+                break
+
+        try :
+            self._socket.close()
+        except socket.error :
+            pass
+
+
+# -----------------------------------------------------------------------------
+
+class MockNetstation( Thread ) :
+
+    """ a local ECI server ; accepts the clients one after another on a loopback port """
+
+    def __init__( self, host = '127.0.0.1', port = 0, latency = 0.0, jitter = 0.0, error_rate = 0.0,
+                  fail_codes = (), version = 1, seed = None ) :
+        """
+            'latency' / 'jitter' -- the response delay and its random addition, in seconds ;
+            'error_rate' -- the probability of answering a command with 'F' ;
+            'fail_codes' -- the command codes ( 'D', 'T', ... ) that always get an 'F' ;
+            'version' -- the protocol version reported for 'Q' .
+        """
+
+        Thread.__init__( self )
+
+        self.setName( "Mock Netstation" )
+        self.setDaemon( True )
+
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.fail_codes = set( fail_codes )
+        self.version = version
+
+        self._random = random.Random( seed )
+
+        self._listener = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+        self._listener.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+        self._listener.bind(  ( host, port )  )
+        self._listener.listen( 4 )
+
+        self._running = True
+        self._lock = Lock()
+        self._connections = []
+
+        self.commands = []
+        self.events = []
+
+    @property
+    def address( self ) :
+        """ ( host, port ) to connect to """
+
+        return self._listener.getsockname()
+
+    ## -----------------------------------------------------------
+
+    def run( self ) :
+
+        while self._running :
+
+            readable, writable, failed = select.select( [ self._listener ], [], [], 0.1 )
+            if not readable : continue
+
+            try :
+                sock, peer = self._listener.accept()
+            except socket.error :
+                continue
+
+            connection = _Connection( self, sock )
+            self._connections.append( connection )
+            connection.start()
+
+        self._listener.close()
+
+    def stop( self, timeout = 1.0 ) :
+        """ stop accepting the clients, close the connections and wait for the threads """
+
+        self._running = False
+        self.join( timeout )
+
+        self.drop_connections()
+
+        for connection in self._connections :
+            connection.join( timeout )
+            connection._writer.join( timeout )
+
+    def drop_connections( self ) :
+        """ close the client connections abruptly ( to test the reconnection logic ) """
+
+        for connection in self._connections :
+
+            try :
+                connection._socket.shutdown( socket.SHUT_RDWR )
+            except socket.error :
+                pass
+
+    ## -----------------------------------------------------------
+
+    def _delay( self ) :
+
+        if self.jitter :
+            return self.latency + self._random.uniform( 0, self.jitter )
+
+        return self.latency
+
+    def _respond( self, command ) :
+        """ the bytes to answer the command with """
+
+        if command.code in self.fail_codes \
+           or ( self.error_rate and self._random.random() < self.error_rate ) :
+
+            return 'F' + struct.pack( '=4c', *'EROR' )
+
+        if command.code == 'Q' :
+            return 'I' + struct.pack( '=B', self.version )
+
+        if command.code in 'XBEATD' :
+            return 'Z'
+
+        return 'F' + struct.pack( '=4c', *'UNKN' )
+
+    def _record( self, command ) :
+
+        with self._lock :
+
+            self.commands.append( command )
+
+            if command.code == 'D' :
+                self.events.append( command.data )
+
+    ## -----------------------------------------------------------
+
+    def reset( self ) :
+        """ forget the recorded commands and events """
+
+        with self._lock :
+
+            self.commands = []
+            self.events = []
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    args = sys.argv[1:] + [ None ] * 4
+
+    port = int( args[0] or 55513 )
+    latency = float( args[1] or 0 ) / 1000
+    jitter = float( args[2] or 0 ) / 1000
+    error_rate = float( args[3] or 0 )
+
+    server = MockNetstation( '0.0.0.0', port, latency, jitter, error_rate )
+    server.start()
+
+    print "mock Netstation listening on %s:%d, ctrl-c to stop" % server.address
+
+    n_seen = 0
+    try :
+        while True :
+
+            time.sleep( 0.5 )
+
+            for command in server.commands[ n_seen : ] :
+                print "%.6f  %s  %r" % ( command.arrival, command.code, command.data )
+
+            n_seen = len( server.commands )
+
+    except KeyboardInterrupt :
+        server.stop()
@@ -0,0 +1,603 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    A multiprocessed implementation of the "egi.netstation" component .
+
+    The interface is the one of egi.threaded.Netstation ; the difference is that the
+    'postman' loop ( reconnection included, see threaded._NetstationThread ) runs
+    in a separate process, so the socket I/O does not compete for the interpreter lock
+    with the rendering loop or with the eye tracker callbacks .
+
+    The events are encoded here, in the calling process, and go to the worker
+    through a pipe as ready-made bytes ; the other commands are pickled .
+    The marker clock of the worker is aligned with the one of this process at the start ,
+    so the event timestamps and the time sent by sync() come from the same clock .
+
+    Every command is stamped when it is sent down the pipe, with the monotonic clock of this
+    process aligned to the one of the worker, so the 'queue' time of the statistics includes
+    the pipe .
+
+    What egi.threaded.Netstation has and this one has not :
+
+        futures      -- the commands return None ; the results come back through 'on_error' ,
+                        response_stats() and enumerate_responses() ;
+        stats()      -- the latency statistics stay in the worker : dump_stats() and queue_stats()
+                        ask it for a summary ( and wait for it, up to a timeout ) ;
+        the queue    -- the pipe is not bounded and takes the commands from any thread : the
+                        'capacity', 'overflow', 'put_timeout', 'spill_path' and 'ring_size'
+                        arguments are accepted ( for the positional calls ) but raise TypeError
+                        unless left at their defaults .
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import simple as internal # Netstation object, mostly
+import threaded # the 'postman' loop
+import socket_wrapper # the transport profiles
+
+#
+# "forward" these names to be used from outside
+#
+
+Error = internal.Eggog
+ms_localtime = internal.ms_localtime
+marker_clock = internal.marker_clock
+SyncPolicy = internal.SyncPolicy
+ResponseTimeout = internal.ResponseTimeout
+WriteTimeout = internal.WriteTimeout
+
+# -----------------------------------------------------------------------------
+
+import cPickle
+import multiprocessing
+import socket # socket.error
+import struct
+import time
+
+from Queue import Empty
+
+from clock import monotonic
+from spool import Spool
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+#
+# the command pipe : every message starts with the time it was sent ( the monotonic clock of
+# the calling process ) ; then the pre-encoded events as they are ( starting with 'D' ) ,
+# or else a pickled ( method name, arguments ) pair or None, the end marker
+#
+
+_stamp = struct.Struct( '=d' )
+
+_EVENTS = 'D'
+
+# the size field following the 'D'
+_event_size = struct.Struct( '=H' )
+
+
+def _split_events( data ) :
+    """ the concatenated 'D' messages back into the single ones """
+
+    messages = []
+    offset = 0
+
+    while offset < len( data ) :
+
+        size = 1 + _event_size.size + _event_size.unpack_from( data, offset + 1 )[0]
+        messages.append( data[ offset : offset + size ] )
+        offset += size
+
+    return messages
+
+
+class _CommandPipe :
+    """
+        the worker end of the command pipe, with the part of the Queue interface the 'postman' uses ;
+        'offset' takes the stamps of the calling process to the monotonic clock of the worker
+    """
+
+    def __init__( self, connection, offset = 0.0 ) :
+
+        self._connection = connection
+        self._offset = offset
+
+    def get( self, block = True, timeout = None ) :
+
+        if timeout is not None and not self._connection.poll( timeout ) :
+            raise Empty
+
+        data = self._connection.recv_bytes()
+
+        command = self._unpack( data[ _stamp.size : ] )
+
+        if command is not None :
+            command.t_queued = _stamp.unpack_from( data )[0] + self._offset
+
+        return command
+
+    def _unpack( self, data ) :
+
+        if data[0] == _EVENTS :
+
+            messages = _split_events( data )
+
+            if len( messages ) == 1 :
+                command = threaded._Command( '_command', { 'name' : 'send_event', 'message' : messages[0] } )
+            else :
+                command = threaded._Command( '_command_batch', { 'name' : 'send_event', 'messages' : messages } )
+
+            # ( the name the responses are reported with )
+            command.future.name = 'send_event'
+
+            return command
+
+        command = cPickle.loads( data )
+        if command is None :
+            return None
+
+        return threaded._Command( *command )
+
+
+class _ResponsePipe :
+    """ the worker end of the response pipe : ( kind, value ) pairs """
+
+    def __init__( self, connection ) :
+
+        self._connection = connection
+
+    def put( self, response, name = None ) :
+
+        self.report( 'response', ( name, response ) )
+
+    def report( self, kind, value ) :
+
+        self._connection.send( ( kind, value ) )
+
+
+class _Postman( threaded._NetstationThread ) :
+    """ the 'postman' loop, reporting the sync estimates back to the calling process """
+
+    def _process( self, packet ) :
+
+        ret = threaded._NetstationThread._process( self, packet )
+
+        if packet.name() == 'sync' :
+            self._received.report( 'sync', self._netstation_object.last_sync )
+
+        return ret
+
+    def _next_packet( self ) :
+        """ the statistics requests are answered here, between the commands : they never wait in the spool """
+
+        while True :
+
+            packet = threaded._NetstationThread._next_packet( self )
+
+            if packet is None or packet is self._retry or packet.name() != 'stats' :
+                return packet
+
+            self._send_stats( **packet.kwargs() )
+
+    def _send_stats( self, reset ) :
+        """ the statistics summary and its report ( see stats.CommandStats ) go back to the calling process """
+
+        depth = 0
+        if self._spool is not None :
+            depth = len( self._spool )
+
+        summary = self.stats.snapshot()
+        summary[ 'queue_depth' ] = depth
+
+        text = self.stats.report( depth )
+
+        if reset :
+            self.stats.reset()
+
+        self._received.report( 'stats', ( summary, text ) )
+
+
+def _serve( commands, responses, reconnect, spool_path, sync_policy, timeouts, profile ) :
+    """ the worker process : align the clock, connect, then run the 'postman' loop until the end marker """
+
+    responses.send( ( 'ready', None ) )
+
+    # ( received right away, so the pipe delay is the only error of the alignment -- of both clocks )
+    ms, generation, t_sent, address = cPickle.loads( commands.recv_bytes() )
+    marker_clock.align( ms, generation )
+    offset = monotonic() - t_sent
+
+    # ( the errors of the setup go back to initialize(), with their cause )
+    try :
+        spool = None
+        if reconnect :
+            spool = Spool( spool_path )
+
+        postman = _Postman( _CommandPipe( commands, offset ), _ResponsePipe( responses ), spool )
+        postman._netstation_object.sync_policy = sync_policy
+        postman._netstation_object.set_timeouts( *timeouts )
+        postman._netstation_object.set_profile( profile )
+    except Exception, e :
+        # ( formatted here : some errors lose their details in the pipe )
+        responses.send( ( 'connected', Error( "%s: %s" % ( e.__class__.__name__, e ) ) ) )
+        return
+
+    try :
+        postman.connect( *address )
+    except socket.error, e :
+        postman.close_spool()
+        responses.send( ( 'connected', e ) )
+        return
+
+    responses.send( ( 'connected', None ) )
+
+    postman.run()
+    postman.close_spool()
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+class Netstation :
+
+    """ Provides Python interface for a connection with the Netstation via a TCP/IP socket. """
+
+    ## -----------------------------------------------------------
+
+    def __init__( self, reconnect = False, spool_path = None, sync_policy = None,
+                  capacity = None, overflow = 'block', put_timeout = None, spill_path = None, ring_size = None,
+                  on_error = None, keep_responses = 256, read_timeout = None, write_timeout = None, profile = 'default' ) :
+        """
+            see egi.threaded.Netstation ; the spool file, if any, is written by the worker process
+            ( and removed by it at the end, if it is a temporary one and empty ) ;
+            there is no bounded queue nor ring ( see above ) : 'capacity', 'overflow', 'put_timeout' ,
+            'spill_path' and 'ring_size' raise TypeError ;
+            'on_error' is called in this process, by whichever thread receives the responses ( any call does ) ;
+            only the socket options of the transport 'profile' apply : the events come already batched
+            as they were sent ( see send_events() )
+        """
+
+        if capacity is not None or overflow != 'block' or put_timeout is not None \
+           or spill_path is not None or ring_size is not None :
+            raise TypeError( "the multiprocess Netstation has no bounded queue : "
+                             "'capacity', 'overflow', 'put_timeout', 'spill_path' and 'ring_size' are not supported" )
+
+        # ( an unknown profile is reported here, not in the worker )
+        socket_wrapper.profile( profile )
+
+        worker_commands, self._commands = multiprocessing.Pipe( False )
+        self._responses, worker_responses = multiprocessing.Pipe( False )
+
+        self._process = multiprocessing.Process( target = _serve, name = "Netstation Process",
+                                                 args = ( worker_commands, worker_responses, reconnect, spool_path, sync_policy,
+                                                          ( read_timeout, write_timeout ), profile ) )
+        self._process.daemon = True
+
+        self._received = threaded._Responses( keep_responses, on_error )
+        self._last_sync = None
+
+        self._profile = profile
+
+        # the last answer of the worker to a 'stats' request
+        self._stats = None
+
+        # the commands sent to the worker ( each marker of a batch counts ) -- less the responses , the pending ones
+        self._sent = 0
+
+        # used in the calling process only
+        self._codec = internal._EventCodec()
+
+    ## -----------------------------------------------------------
+
+    def _put( self, name, kwargs = None, count = 1 ) :
+        """ send a command to the worker """
+
+        self._send( cPickle.dumps( ( name, kwargs or {} ), cPickle.HIGHEST_PROTOCOL ), count )
+
+    def _send( self, data, count = 1 ) :
+        """ send a message to the worker ; 'count' -- the number of the responses it is going to give back """
+
+        self._commands.send_bytes( _stamp.pack( monotonic() ) + data )
+        self._sent += count
+
+        # keep the response pipe flowing, or the worker would block on it
+        self._drain()
+
+    def _drain( self ) :
+        """ move the available responses from the pipe to the local queue """
+
+        while self._responses.poll() :
+
+            try :
+                kind, value = self._responses.recv()
+            except EOFError :
+                # the worker has finished
+                break
+
+            if kind == 'sync' :
+                self._last_sync = value
+            elif kind == 'stats' :
+                self._stats = value
+            else :
+                name, response = value
+                self._received.put( response, name )
+
+    ## -----------------------------------------------------------
+
+    def enumerate_responses( self ) :
+        """ yield the responses received so far """
+
+        self._drain()
+
+        while self._received.qsize() :
+
+            yield self._received.get()
+
+
+    def process_responces( self ) :
+
+        for resp in self.enumerate_responses() :
+
+            pass
+
+    ## -----------------------------------------------------------
+
+    def response_stats( self ) :
+        """ the results received so far ( see egi.threaded.Netstation.response_stats() ) """
+
+        self._drain()
+
+        return self._received.summary()
+
+    def _worker_stats( self, reset, timeout ) :
+        """ ask the worker for its statistics ; ( summary, report ) or None if there is no answer in 'timeout' seconds """
+
+        self._stats = None
+        self._put( 'stats', { 'reset' : reset }, 0 )
+
+        deadline = time.time() + timeout
+
+        while self._stats is None and self._ns_process_is_running() :
+
+            remaining = deadline - time.time()
+            if remaining <= 0 :
+                break
+
+            if self._responses.poll( min( remaining, 0.01 ) ) :
+                self._drain()
+
+        return self._stats
+
+    def queue_stats( self, timeout = 1.0 ) :
+        """
+            the commands waiting in the spool of the worker ( None if it has not answered ) ; the pipe
+            is not bounded, so nothing is dropped, spilled or refused ( see egi.threaded.Netstation.queue_stats() )
+        """
+
+        stats = self._worker_stats( False, timeout )
+
+        return { 'depth' : None if stats is None else stats[0][ 'queue_depth' ],
+                 'capacity' : None,
+                 'overflow' : None,
+                 'dropped' : 0,
+                 'spilled' : 0,
+                 'refused' : 0 }
+
+    def dump_stats( self, reset = True, timeout = 1.0 ) :
+        """
+            print the statistics of the worker ( see egi.threaded.Netstation.dump_stats() ) and start over ;
+            returns the summary printed, or None if the worker has not answered in 'timeout' seconds
+        """
+
+        stats = self._worker_stats( reset, timeout )
+
+        if stats is None :
+            print " egi: no statistics from the worker in %s s " % ( timeout, )
+            return None
+
+        summary, report = stats
+
+        summary[ 'profile' ] = self._profile
+
+        print " egi: '%s' transport, " % ( self._profile, ) + report
+
+        return summary
+
+    ## -----------------------------------------------------------
+
+    def _ns_process_is_running( self ) :
+        """ returns True if our 'postman' process is stil busy with doing something """
+
+        return self._process.is_alive()
+
+    ## -----------------------------------------------------------
+
+    def initialize( self, str_address, port_no ) :
+        """
+            start the 'postman' process and connect ; a connection error ( socket.error ) is raised here ,
+            a worker that cannot start ( e.g. a bad 'spool_path' ) raises Error
+        """
+
+        self._process.start()
+
+        try :
+            kind, value = self._responses.recv() # 'ready'
+
+            self._commands.send_bytes( cPickle.dumps( ( ms_localtime(), marker_clock.generation, monotonic(),
+                                                        ( str_address, port_no ) ), cPickle.HIGHEST_PROTOCOL ) )
+
+            kind, error = self._responses.recv() # 'connected'
+
+        except ( EOFError, IOError ), e :
+
+            self._process.join()
+            raise Error( "the worker process has stopped at the start, exit code %s (%r)" % ( self._process.exitcode, e ) )
+
+        if error is not None :
+
+            self._process.join()
+
+            if isinstance( error, socket.error ) :
+                raise error
+
+            raise Error( "the worker process could not start (%s)" % ( error, ) )
+
+        # return None
+
+    def finalize( self, seconds_timeout = 2 ) :
+        """
+            send the process the 'Done' message and wait until it finishes ( terminate it after 'seconds_timeout' ) ;
+            returns the number of the commands that have got no response ( 0 when everything went fine )
+        """
+
+        self._send( cPickle.dumps( None ), 0 )
+
+        t_start = time.time()
+
+        while ( time.time() - t_start ) < seconds_timeout and self._ns_process_is_running() :
+
+            self.process_responces()
+            self._process.join( 0.01 )
+
+        if self._ns_process_is_running() :
+            self._process.terminate()
+            self._process.join()
+
+        # ( whatever the worker had written before it stopped )
+        self.process_responces()
+
+        pending = max( 0, self._sent - self._received.received )
+
+        if pending :
+            print " egi: the worker process has stopped, %d commands have got no response " % ( pending, )
+
+        # debug
+        print " egi: stopping ... "
+
+        return pending
+
+    ## -----------------------------------------------------------
+
+    def BeginSession( self ) :
+        """ say 'hi!' to the server """
+
+        self._put( 'BeginSession' )
+
+    def EndSession( self ) :
+        """ say 'bye' to the server """
+
+        self._put( 'EndSession' )
+
+    ## -----------------------------------------------------------
+
+    def StartRecording( self ) :
+        """ start recording to the selected ( externally ) file """
+
+        self._put( 'StartRecording' )
+
+    def StopRecording( self ) :
+        """ stop recording to the selected file ( see egi.threaded.Netstation.StopRecording() ) """
+
+        self._put( 'StopRecording' )
+
+    ## -----------------------------------------------------------
+
+    # not supposed to be used "manually", see egi.threaded.Netstation
+
+    def _SendAttentionCommand( self ) :
+        """ Sends and 'Attention' command """
+
+        self._put( 'SendAttentionCommand' )
+
+    def _SendLocalTime( self, ms_time = None ) :
+        """ Send the local time (in ms) to Netstation; usually this happens after an 'Attention' command """
+
+        if ms_time is None :
+            ms_time = ms_localtime()
+
+        self._put( 'SendLocalTime', { 'ms_time' : ms_time } )
+
+    ## -----------------------------------------------------------
+
+    def sync( self, timestamp = None, rounds = None, force = False ) :
+        """ the attention command and the time info ( see egi.simple.Netstation.sync() ) ; done by the worker """
+
+        self._put( 'sync', { 'timestamp' : timestamp, 'rounds' : rounds, 'force' : force } )
+
+    def capture( self, path ) :
+        """ journal all the traffic to the given file ( see journal.py ) ; None stops capturing """
+
+        self._put( 'capture', { 'path' : path } )
+
+    def sync_info( self ) :
+        """ the estimate of the last measured sync, as far as the responses have been received ( or None ) """
+
+        self._drain()
+
+        return self._last_sync
+
+    ## -----------------------------------------------------------
+
+    def send_event( self, key, timestamp = None, label = None, description = None, table = None, pad = False ) :
+        """
+            Send an event ( see egi.threaded.Netstation.send_event() ) ;
+            the message is encoded here and the timestamp, if None, is taken now .
+        """
+
+        if timestamp is None :
+            timestamp = ms_localtime()
+
+        self._send( self._codec.pack( key, timestamp, label, description, table, pad ) )
+
+
+    def send_events( self, events ) :
+        """
+            Send several events at once ( see egi.simple.Netstation.send_events() ) ;
+            the whole batch goes to the worker as one message .
+        """
+
+        now = ms_localtime()
+
+        messages = []
+        for e in events :
+
+            if isinstance( e, dict ) :
+                if e.get( 'timestamp' ) is None :
+                    e = dict( e, timestamp = now )
+                messages.append( self._codec.pack( **e ) )
+
+            else :
+                if len( e ) < 2 or e[1] is None :
+                    e = ( e[0], now ) + tuple( e[2:] )
+                messages.append( self._codec.pack( *e ) )
+
+        if messages :
+            self._send( ''.join( messages ), len( messages ) )
+
+
+    def event_template( self, key, label = None, description = None, table = None, pad = False ) :
+        """ Pre-encode an event to be sent with send_template() """
+
+        return internal.EventTemplate( key, label, description, table, pad, self._codec )
+
+
+    def send_template( self, template, timestamp = None ) :
+        """ Send a pre-encoded event ( see event_template() ) ; the timestamp is taken now, if not given """
+
+        self._send( template.stamp( timestamp ) )
+
+
+    ## -----------------------------------------------------------
+
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
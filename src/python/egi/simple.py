@@ -21,11 +21,15 @@ from __future__ import with_statement # for debug dumps
     
 """     
 
-# import socket
+import socket # socket.timeout
 from socket_wrapper import Socket     
 import struct     
 
-import math, time # for time in milliseconds     
+import time # for the timeouts     
+
+from collections import deque
+
+from clock import MarkerClock, SyncPolicy, TimeReference, monotonic
 
 import sys, exceptions # sys.
 
@@ -75,47 +79,46 @@ class Eggog( exceptions.Exception ) :
             return True     
         
     
-# -----------------------------------------------------------------------------
-# -----------------------------------------------------------------------------
+class ConnectionLost( Eggog ) :
+    """ the connection to Netstation is gone ( closed by the other side or broken ) """
+
+    pass
 
-#
-# accessory functions     
-#
 
-global _ts_last 
-_ts_last = 0     
-def ms_localtime(warnme = True) :
-    """ gives the local time in milliseconds ( modulo 1.000.000.000 ) """
+class ResponseTimeout( Eggog ) :
+    """ the response has not come in time ; the connection is still usable -- the late response is skipped when it comes """
 
-    global _ts_last
-  
-    # we just need some standard way to represent local time with ms precision
-    # ( and by a 32-bit integer, but this can wait until 2036 )
+    pass
 
-    #             ms    s    m    h     
-    # ms_one_day = 1000 * 60 * 60 * 24     
-    # current_time = math.floor( time.time() * 1000 ) % ms_one_day     
 
-    ## ms_current_time = int(  math.floor( time.time() * 1000 )  )  
-    ## return ms_current_time     
+class WriteTimeout( ConnectionLost ) :
+    """ a command could not be written in time ; a part of it may have gone out, so the connection is not usable any more """
 
-    # debug ( check the byte order )
-    # return 1     
+    pass
+        
     
-    ## seconds_in_a_day = 60 * 60 * 24 # 86400     
-    ## day_time_ms = int(   math.floor(  ( time.time() % seconds_in_a_day ) * 1000  )   )     
-    ## 2^32 = 4294967296
-    modulo = 1000000     
-    # modulo = 10 # tests     
-    ms_remainder = int(   math.floor(  ( time.time() % modulo ) * 1000  )   )     
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
 
-    if warnme and ( ms_remainder < _ts_last ) :     
+#
+# accessory functions     
+#
 
-        raise Eggog( "internal 32-bit counter passed through zero, please resynchronize ( call .synch() once again )" )     
+#
+# the clock for all the timestamps -- the events and sync() have to use the same one ;
+# it is monotonic and counts from the start of the session ( see clock.py )
+#
+
+marker_clock = MarkerClock()
+
+def ms_localtime( warnme = True ) :
+    """
+        gives the marker time in milliseconds, a 32-bit value ;
+        'warnme' is not used any more : the clock does not pass through zero ,
+        it starts a new epoch and the clients sync() again ( see clock.MarkerClock )
+    """
 
-    _ts_last = ms_remainder
-  
-    return ms_remainder # finish the recording before midnight ( and start after 00:00 )     
+    return marker_clock()
 
 
 # -----------------------------------------------------------------------------
@@ -585,6 +588,235 @@ class _DataFormat :
         return result_str     
         
 
+# -----------------------------------------------------------------------------
+
+#
+# a "compiled" variant of _DataFormat.pack() : one 'struct.Struct' is built per message layout
+# ( label / description lengths, value types and text lengths of the table ) and cached ,
+# then the whole message is written with a single pack_into() into a buffer reused from call to call .
+#
+# the output is byte-for-byte the same as the one of _DataFormat.pack() ; whatever the codec
+# does not know how to handle ( padded keys, values of other types, etc. ) goes to the old encoder .
+#
+
+class _EventCodec :
+    """ a faster, byte-compatible replacement for _DataFormat.pack() """
+
+    # 'D' , the size of the rest , timestamp , duration , key
+    _header_fmt = "=sH2L4s"
+
+    # Netstation ignores the byte order for the floating-point values ( see _DataFormat )
+    _double = struct.Struct( '!d' )
+
+    # the layouts depend on the string lengths -- don't let the cache grow forever
+    max_layouts = 256
+
+    def __init__( self, data_fmt = None, size = 1024 ) :
+
+        if data_fmt is None : data_fmt = _DataFormat()
+
+        self._legacy = data_fmt
+        self._buffer = bytearray( size )
+        self._layouts = {}
+
+        # the value types we can compile ( the exact types, as in _DataFormat._pack_data() )
+        self._known_types = dict( data_fmt._translation_table )
+        del self._known_types[ type('') ] # texts go to the layout by their length
+
+    ## -----------------------------------------------------------
+
+    def _signature( self, label, description, items ) :
+        """ the layout key of the message, or None if the message has to go to the old encoder """
+
+        if type( label ) is not str or type( description ) is not str :
+            return None
+
+        signature = [ len( label ), len( description ) ]
+
+        for k, v in items :
+
+            if type( k ) is not str or len( k ) != 4 :
+                return None
+
+            t = type( v )
+            if t is str :
+                signature.append( len( v ) )
+            elif t in self._known_types :
+                signature.append( t )
+            else :
+                return None
+
+        return tuple( signature )
+
+
+    def _compile( self, signature ) :
+        """ build the 'struct' object and the constant fields for the given layout """
+
+        label_length, description_length = signature[:2]
+
+        fmt = [ self._header_fmt,
+                'B%ds' % ( label_length, ),
+                'B%ds' % ( description_length, ),
+                'B' ]
+
+        items = []
+        doubles = []
+
+        for i, entry in enumerate( signature[2:] ) :
+
+            if type( entry ) is int :
+
+                # a text of the given length
+                items.append( ( 'TEXT', entry ) )
+                fmt.append( '4s4sH%ds' % ( entry, ) )
+                continue
+
+            desctype, value_fmt = self._known_types[ entry ]
+            length = struct.calcsize( value_fmt )
+            items.append( ( desctype, length ) )
+
+            if value_fmt.startswith( '=' ) :
+
+                fmt.append( '4s4sH' + value_fmt[1:] )
+
+            else :
+
+                # a placeholder, to be filled in with another byte order after the main pack_into()
+                offset = struct.calcsize( ''.join( fmt ) + '4s4sH' )
+                doubles.append( ( i, offset ) )
+                fmt.append( '4s4sH%dx' % ( length, ) )
+
+        packer = struct.Struct( ''.join( fmt ) )
+
+        # 'D' and the size field itself are not counted
+        total_length = packer.size - struct.calcsize( '=sH' )
+
+        if len( self._layouts ) >= self.max_layouts :
+            self._layouts.clear()
+
+        layout = ( packer, total_length, items, doubles )
+        self._layouts[ signature ] = layout
+
+        return layout
+
+    ## -----------------------------------------------------------
+
+    def encode( self, key, timestamp = None, label = None, description = None, table = None, pad = False ) :
+        """
+            write the message into the internal buffer and return its size ;
+            None is returned if the message has to be packed by the old encoder .
+        """
+
+        if pad : return None
+
+        if label is None : label = ''
+        if description is None : description = ''
+
+        if table is None :
+            items = ()
+        else :
+            items = table.items()
+
+        nkeys = len( items )
+        if nkeys > 255 :
+            raise Eggog( "too many keys to send (%d > 255)" % (nkeys, ) )
+
+        signature = self._signature( label, description, items )
+        if signature is None : return None
+
+        if timestamp is None :
+            timestamp = ms_localtime()
+
+        if not is_32_bit_int_compatible( timestamp ) :
+
+            raise Eggog(  "only 'small' 32-bit integer values less than %d are accepted as timestamps, not %s"  %  ( 0xffffFFFF, timestamp )  )
+
+        layout = self._layouts.get( signature )
+        if layout is None :
+            layout = self._compile( signature )
+
+        packer, total_length, item_consts, doubles = layout
+
+        args = [ 'D', total_length, timestamp, 1, key,
+                 min( len( label ), 255 ), label,
+                 min( len( description ), 255 ), description,
+                 nkeys ]
+
+        for ( k, v ), ( desctype, length ) in zip( items, item_consts ) :
+
+            args.append( k )
+            args.append( desctype )
+            args.append( length )
+            if type( v ) is not float :
+                args.append( v )
+
+        if packer.size > len( self._buffer ) :
+            self._buffer = bytearray( max( packer.size, 2 * len( self._buffer ) ) )
+
+        buf = self._buffer
+        packer.pack_into( buf, 0, *args )
+
+        for i, offset in doubles :
+            self._double.pack_into( buf, offset, items[i][1] )
+
+        return packer.size
+
+
+    def view( self, size ) :
+        """ a read-only view of the first 'size' bytes of the internal buffer ( valid until the next encode() ) """
+
+        return buffer( self._buffer, 0, size )
+
+
+    def pack( self, key, timestamp = None, label = None, description = None, table = None, pad = False ) :
+        """ same as _DataFormat.pack() """
+
+        size = self.encode( key, timestamp, label, description, table, pad )
+
+        if size is None :
+            return self._legacy.pack( key, timestamp, label, description, table, pad )
+
+        return str( self.view( size ) )
+
+
+# -----------------------------------------------------------------------------
+
+#
+# pre-encoded events : the same key / label / table are sent again and again by the trials ,
+# so the message is encoded once and only the timestamp is patched in at the sending time .
+#
+
+class EventTemplate :
+    """ an event message encoded once, with a placeholder for the timestamp """
+
+    # the timestamp follows 'D' and the size field in the event header ( "=sH2L4s" )
+    _timestamp = struct.Struct( '=L' )
+    _timestamp_offset = struct.calcsize( '=sH' )
+
+    def __init__( self, key, label = None, description = None, table = None, pad = False, codec = None ) :
+        """ encode the event ; the arguments are the same as for Netstation.send_event() """
+
+        if codec is None : codec = _EventCodec()
+
+        message = codec.pack( key, 0, label, description, table, pad )
+
+        self.key = key
+        self._head = message[ : self._timestamp_offset ]
+        self._tail = message[ self._timestamp_offset + self._timestamp.size : ]
+
+    def stamp( self, timestamp = None ) :
+        """ return the complete message with the given timestamp ( the current time by default ) """
+
+        if timestamp is None :
+            timestamp = ms_localtime()
+
+        if not is_32_bit_int_compatible( timestamp ) :
+
+            raise Eggog(  "only 'small' 32-bit integer values less than %d are accepted as timestamps, not %s"  %  ( 0xffffFFFF, timestamp )  )
+
+        return ''.join( ( self._head, self._timestamp.pack( timestamp ), self._tail ) )
+
+
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
 
@@ -597,12 +829,42 @@ class Netstation :
         self._system_spec = _get_endianness_string()
         self._fmt = _Format()
         self._data_fmt = _DataFormat()     
+        self._codec = _EventCodec( self._data_fmt )
+
+        # the pipelined mode ( see pipeline() ) ; zero means "wait for every response"
+        self._max_in_flight = 0
+        self._in_flight = deque()
+        self._completed = deque( maxlen = 1024 )
+        self._on_response = None
+
+        # the number of the measured round trips per sync() ( see _measured_sync() ) ;
+        # zero means the plain "attention + time" exchange
+        self.sync_rounds = 0
+        self.last_sync = None
+
+        # the marker clock epoch of the last sync() ( None -- not synced yet )
+        self._clock_generation = None
+
+        # with a policy ( see clock.SyncPolicy ), sync() is skipped while the last one is good enough
+        self.sync_policy = None
+        self.syncs_skipped = 0
+        self._reference = None
+
+        # the number of the responses still to come for the commands that have timed out
+        self._late = 0
+
+        # the transport profile ( see set_profile() )
+        self.profile = 'default'
 
     def connect( self, str_address, port_no ):
         """ connect to the Netstaton machine """
 
         self._socket.connect( str_address, port_no )
 
+        # a new connection needs a new time reference
+        self._reference = None
+        self._late = 0
+
         # return None     
 
     def disconnect( self ):
@@ -612,13 +874,53 @@ class Netstation :
 
         # return None         
 
+    def capture( self, path ) :
+        """ journal all the traffic to the given file ( see journal.py ) ; None stops capturing """
+
+        self._socket.capture( path )
+
+    def set_profile( self, name ) :
+        """ the socket options of a transport profile ( 'default', 'latency', 'throughput', see socket_wrapper.PROFILES ) """
+
+        self.profile = name
+
+        return self._socket.set_profile( name )
+
+    def set_timeouts( self, read_timeout = None, write_timeout = None ) :
+        """
+            the deadlines, in seconds ( None -- wait forever ) : a response not read within 'read_timeout'
+            raises ResponseTimeout, a write making no progress for 'write_timeout' raises WriteTimeout
+        """
+
+        self._socket.set_timeouts( read_timeout, write_timeout )
+
     ## -----------------------------------------------------------
         
     def GetServerResponse( self, b_raise = True ):
-        """ read the response from the socket and convert it to a True / False resulting value """
+        """
+            read the response from the socket and convert it to a True / False resulting value ;
+            with a read timeout ( see set_timeouts() ) raises ResponseTimeout if it has not come in time
+        """
+
+        timeout = self._socket.read_timeout
+
+        deadline = None
+        if timeout is not None :
+            deadline = monotonic() + timeout
+
+        try :
 
-        code = self._socket.read(1)
+            # the responses of the commands that have timed out go first
+            while self._late :
+                self._next_response( deadline )
+                self._late -= 1
 
+            code, info = self._next_response( deadline )
+
+        except socket.timeout :
+
+            self._late += 1
+            raise ResponseTimeout( "no response in %s s" % ( timeout, ) )
 
         if code == 'Z':
 
@@ -626,12 +928,9 @@ class Netstation :
 
         elif code == 'F' : # an 'F' <error code> sequence     
 
-            error_info_length = self._fmt.format_length( code )     
-            error_info = self._socket.read( error_info_length )
-
             if b_raise :
 
-                err_msg = "server returned an error : " + repr( self._fmt.unpack(code, error_info) )     
+                err_msg = "server returned an error : " + repr( self._fmt.unpack(code, info) )     
                 raise Eggog( err_msg )     
                 
             else :     
@@ -639,9 +938,7 @@ class Netstation :
         
         elif code == 'I' : # a version byte should follow     
 
-            version_length = self._fmt.format_length( code )     
-            version_info = self._socket.read( version_length )
-            version = self._fmt.unpack( code, version_info )     
+            version = self._fmt.unpack( code, info )     
 
             ## # debug
             ## print version
@@ -660,10 +957,170 @@ class Netstation :
             else :
 
                 return False     
+
+
+    def _next_response( self, deadline = None ) :
+        """
+            the code and the data of the next response ; nothing is taken from the socket until
+            the whole response has arrived, so after a timeout the reading starts over where it was
+        """
+
+        if not self._socket.fill_to( 1, deadline ) :
+
+            # the end of the stream : nothing else will ever come
+            raise ConnectionLost( "the connection was closed by the server" )
+
+        code = self._socket.peek()
+
+        size = 1
+        if code in ( 'F', 'I' ) :
+            size += self._fmt.format_length( code )
+
+        if not self._socket.fill_to( size, deadline ) :
+            raise ConnectionLost( "the connection was closed by the server" )
+
+        return code, self._socket.read( size )[ 1 : ]
+
+
+    def _write( self, data ) :
+
+        try :
+            self._socket.write( data )
+        except socket.timeout :
+            raise WriteTimeout( "the command could not be written in %s s" % ( self._socket.write_timeout, ) )
             
     
     ## -----------------------------------------------------------
     
+    #
+    # the pipelined mode : the commands are written one after another without waiting for
+    # the responses, which are then matched to the commands in the FIFO order ( Netstation
+    # answers every command with exactly one 'Z' / 'F' / 'I' and in the order of arrival ) .
+    #
+
+    def pipeline( self, max_in_flight = 16, on_response = None ) :
+        """
+            switch to the pipelined mode with up to 'max_in_flight' commands waiting for the response ;
+            'on_response( name, result )' is called for every response, where the result is
+            the usual GetServerResponse() value or an Eggog instance for a failed command .
+            With no callback the results are kept for collect_responses() .
+        """
+
+        if max_in_flight < 1 :
+            raise Eggog( "at least one command has to be allowed in flight (not %s)" % ( max_in_flight, ) )
+
+        self._max_in_flight = max_in_flight
+        self._on_response = on_response
+
+
+    def end_pipeline( self ) :
+        """ wait for all the outstanding responses and switch back to the "one command at a time" mode """
+
+        results = self.collect_responses( wait = True )
+
+        self._max_in_flight = 0
+        self._on_response = None
+
+        return results
+
+
+    def is_pipelined( self ) :
+
+        return self._max_in_flight > 0
+
+
+    def in_flight( self ) :
+        """ the number of the commands waiting for the response """
+
+        return len( self._in_flight )
+
+
+    def collect_responses( self, wait = False ) :
+        """
+            read the responses that have already arrived ( or all of the outstanding ones, if 'wait' ) ;
+            returns the ( name, result ) pairs completed since the previous call .
+        """
+
+        while self._in_flight and ( wait or self._socket.poll() ) :
+
+            self._complete_one()
+
+        results = list( self._completed )
+        self._completed.clear()
+
+        return results
+
+
+    def _complete_one( self ) :
+        """ read the response for the oldest command in flight """
+
+        name = self._in_flight.popleft()
+
+        try :
+            result = self.GetServerResponse()
+        except Eggog, e :
+            result = e
+
+        if self._on_response is not None :
+            self._on_response( name, result )
+        else :
+            self._completed.append( ( name, result ) )
+
+
+    def _command( self, name, message ) :
+        """ write the message ; wait for the response unless in the pipelined mode """
+
+        if not self._max_in_flight :
+
+            self._write( message )
+
+            return self.GetServerResponse()
+
+        while len( self._in_flight ) >= self._max_in_flight :
+
+            self._complete_one()
+
+        self._write( message )
+        self._in_flight.append( name )
+
+        # return None
+
+
+    def _command_batch( self, name, messages ) :
+        """ write all the messages at once, then read ( or, if pipelined, queue ) all the responses """
+
+        n = len( messages )
+
+        if not self._max_in_flight :
+
+            self._write( ''.join( messages ) )
+
+            results = []
+            for i in xrange( n ) :
+
+                # every response has to be read, so a failure does not stop the loop --
+                # -- unless the connection is gone : then none of the rest will come
+                try :
+                    results.append( self.GetServerResponse() )
+                except ConnectionLost :
+                    raise
+                except Eggog, e :
+                    results.append( e )
+
+            return results
+
+        # the batch goes out as a whole, even if it is bigger than the window
+        while self._in_flight and len( self._in_flight ) + n > self._max_in_flight :
+
+            self._complete_one()
+
+        self._write( ''.join( messages ) )
+        self._in_flight.extend( [ name ] * n )
+
+        # return None
+
+    ## -----------------------------------------------------------
+    
     def BeginSession( self ) :     
         """ say 'hi!' to the server """     
 
@@ -671,21 +1128,17 @@ class Netstation :
         ## assert self.GetServerResponse() == True # " the quick-&-dirty way " // to-do: create an own exception     
 
         message = self._fmt.pack( 'Q', self._system_spec )
-        self._socket.write( message )     
 
         # debug
         print "BS: ", message     
 
-        return self.GetServerResponse()     
+        return self._command( 'BeginSession', message )
         
 
     def EndSession( self ):
         """ say 'bye' to the server """
 
-        self._socket.write( 'X' )     
-        # self._connection.write( 'X' ).flush()     
-
-        return self.GetServerResponse()     
+        return self._command( 'EndSession', 'X' )
         
     
     ## -----------------------------------------------------------
@@ -693,9 +1146,7 @@ class Netstation :
     def StartRecording( self ):
         """ start recording to the selected ( externally ) file """
 
-        self._socket.write( 'B' )     
-        
-        return self.GetServerResponse()     
+        return self._command( 'StartRecording', 'B' )
 
 
     def StopRecording( self ):
@@ -704,18 +1155,14 @@ class Netstation :
             if the session is not closed yet .     
         """     
 
-        self._socket.write( 'E' )     
-        
-        return self.GetServerResponse()     
+        return self._command( 'StopRecording', 'E' )
 
     ## -----------------------------------------------------------
 
     def SendAttentionCommand( self ):
         """ Sends and 'Attention' command """ # also pauses the recording ?
 
-        self._socket.write( 'A' )
-        
-        return self.GetServerResponse()     
+        return self._command( 'SendAttentionCommand', 'A' )
 
 
     def SendLocalTime( self, ms_time = None ):
@@ -729,22 +1176,146 @@ class Netstation :
 	# # debug     
 	# print message, struct.unpack('=L', message[1:])     
 
-        self._socket.write( message )     
-
-        return self.GetServerResponse()     
+        return self._command( 'SendLocalTime', message )
         
     ## -----------------------------------------------------------
 
-    def sync( self, timestamp = None ) :
-        """ a shortcut for sending the 'attention' command and the time info """
+    def sync( self, timestamp = None, rounds = None, force = False ) :
+        """
+            a shortcut for sending the 'attention' command and the time info ;
+            with 'rounds' ( .sync_rounds by default ) above zero and no explicit timestamp ,
+            the transit delay is measured and compensated, see _measured_sync() .
 
-        if ( self.SendAttentionCommand() ) and ( self.SendLocalTime( timestamp ) ) :
+            With a .sync_policy the call does nothing ( and returns True ) while the last
+            time reference is still good enough -- unless 'force' is set or the timestamp is given .
+        """
 
+        if rounds is None :
+            rounds = self.sync_rounds
+
+        if not ( force or timestamp is not None or self.sync_due() ) :
+
+            self.syncs_skipped += 1
             return True
 
-        else :
+        self._clock_generation = marker_clock.generation
+
+        if rounds > 0 and timestamp is None :
 
+            ret = self._measured_sync( rounds )
+            self._referenced( self.last_sync[ 'uncertainty' ] )
+
+            return ret
+
+        if self.is_pipelined() :
+
+            # the responses are reported by collect_responses()
+            self.SendAttentionCommand()
+            self.SendLocalTime( timestamp )
+
+            # ( the quality of this one is unknown )
+            self._referenced( None )
+
+            return None
+
+        if not self.SendAttentionCommand() :
+
+            raise Eggog( "sync command failed!" )
+
+        t_sent = marker_clock()
+
+        if not self.SendLocalTime( timestamp ) :
+
+            raise Eggog( "sync command failed!" )
+
+        # the time was taken before writing, so it is late by no more than the round trip
+        self._referenced( marker_clock() - t_sent )
+
+        return True
+
+
+    def sync_due( self ) :
+        """ would sync() do anything now ? ( always, without a .sync_policy ) """
+
+        if self.sync_policy is None :
+            return True
+
+        return self.sync_policy.due( self._reference, marker_clock.generation )
+
+
+    def _referenced( self, uncertainty ) :
+
+        self._reference = TimeReference( monotonic(), marker_clock.generation, uncertainty )
+        
+
+    def _check_clock( self ) :
+        """ sync() again if the marker clock has started a new epoch since the last sync """
+
+        if self._clock_generation is not None and self._clock_generation != marker_clock.generation :
+
+            self.sync()
+        
+
+    def _roundtrip( self, message ) :
+        """ write the message and wait for its response, whatever the mode is """
+
+        self._write( message )
+
+        return self.GetServerResponse()
+
+
+    def _measured_sync( self, rounds ) :
+        """
+            an NTP-like sync : 'rounds' attention round trips are timed, then the time is sent
+            corrected by half of the shortest of them -- Netstation takes the time when it reads
+            the 'T' command, which happens about half a round trip after we write it .
+
+            The estimate is kept in .last_sync ( all the values in ms ) :
+                'rtt_min' -- the shortest attention round trip ,
+                'rtt' -- the round trip of the time command itself ,
+                'offset' -- the correction added to the local time ,
+                'uncertainty' -- the largest possible error of the time reference .
+
+            With rounds = 1 this costs the same two round trips as the plain sync() .
+        """
+
+        # the round trips are timed one by one, so nothing else may be in flight
+        while self._in_flight :
+            self._complete_one()
+
+        rtt_min = None
+        for i in xrange( rounds ) :
+
+            t_start = monotonic()
+            if not self._roundtrip( 'A' ) :
+                raise Eggog( "sync command failed!" )
+
+            rtt = monotonic() - t_start
+            if rtt_min is None or rtt < rtt_min :
+                rtt_min = rtt
+
+        # ( the last attention is the one right before the time command, as Netstation wants it )
+
+        offset = int( round( 1000 * rtt_min / 2 ) )
+
+        t_start = monotonic()
+        ms_time = ms_localtime() + offset
+        if not self._roundtrip( self._fmt.pack( 'T', ms_time ) ) :
             raise Eggog( "sync command failed!" )
+
+        rtt = monotonic() - t_start
+
+        # the 'T' was read somewhere within its own round trip ; take the farthest end ,
+        # plus the 1 ms resolution of the timestamps
+        uncertainty = 1000 * max( rtt_min / 2, rtt - rtt_min / 2 ) + 1
+
+        self.last_sync = { 'rounds' : rounds,
+                           'rtt_min' : 1000 * rtt_min,
+                           'rtt' : 1000 * rtt,
+                           'offset' : offset,
+                           'uncertainty' : uncertainty }
+
+        return True
         
     
     ## -----------------------------------------------------------
@@ -763,7 +1334,8 @@ class Netstation :
                               note that the "clock" used to produce the timestamp should be the same
                               as for the sync() method, and, ideally,
                               should be obtained via a call to the same function ;
-                              if 'timestamp' is None, a time.time() wrapper is used .
+                              if 'timestamp' is None, ms_localtime() is taken -- the marker clock
+                              ( monotonic, see clock.MarkerClock ) sync() uses as well .
             -- 'label' -- a string with any additional information, up to 256 characters .     
             -- 'description' -- more additional information can go here ( same limit applies ) .
             -- 'table' -- a standart Python dictionary, where keys are 4-byte identifiers,
@@ -804,8 +1376,15 @@ class Netstation :
             
         '''     
 
-        message = self._data_fmt.pack( key, timestamp, label, description, table, pad )     
-        self._socket.write( message )     
+        self._check_clock()
+
+        # written straight from the codec buffer, unless the old encoder had to be used
+        size = self._codec.encode( key, timestamp, label, description, table, pad )
+
+        if size is None :
+            message = self._data_fmt.pack( key, timestamp, label, description, table, pad )
+        else :
+            message = self._codec.view( size )
 
         '''     
         # # debug     
@@ -818,7 +1397,55 @@ class Netstation :
 
         '''     
 
-        return self.GetServerResponse()     
+        return self._command( 'send_event', message )
+
+
+    def send_events( self, events ) :
+        """
+            Send several events with a single write and read all the responses together .
+
+            'events' is a sequence of send_event() argument tuples
+            ( key, timestamp, label, description, table, pad -- the trailing ones may be omitted )
+            or of dictionaries with the send_event() keyword arguments .
+
+            Returns the list of the results, one per event ; a failed event gets its Eggog
+            in the list instead of raising it ( nothing is returned in the pipelined mode ) .
+        """
+
+        self._check_clock()
+
+        messages = []
+        for e in events :
+
+            if isinstance( e, dict ) :
+                messages.append( self._codec.pack( **e ) )
+            else :
+                messages.append( self._codec.pack( *e ) )
+
+        if not messages :
+            return []
+
+        return self._command_batch( 'send_event', messages )
+
+
+    def event_template( self, key, label = None, description = None, table = None, pad = False ) :
+        """
+            Pre-encode an event to be sent with send_template() ;
+            the arguments are the same as for send_event(), except for the timestamp .
+        """
+
+        return EventTemplate( key, label, description, table, pad, self._codec )
+
+
+    def send_template( self, template, timestamp = None ) :
+        """
+            Send a pre-encoded event ( see event_template() ) ; only the timestamp
+            is written into the message here, the rest was encoded beforehand .
+        """
+
+        self._check_clock()
+
+        return self._command( 'send_template', template.stamp( timestamp ) )
 
 
     ## -----------------------------------------------------------
@@ -842,9 +1469,8 @@ class Netstation :
 
         else: 
 
-            # one day is 1000 * 60 * 60 * 24 milliseconds
-            one_day = 1000 * 60 * 60 * 24
-            current_time = math.floor( time.time() * 1000 ) % one_day     
+            # the marker clock, as for send_event() and sync() -- the events of both paths are on the same time line
+            current_time = ms_localtime()
 
 
         default_duration = 1 # also in milliseconds     
@@ -859,9 +1485,7 @@ class Netstation :
                                       struct.pack('4s', markercode),
                                       )
 
-        self._socket.write( data_string )     
-
-        return self.GetServerResponse()     
+        return self._command( 'SendSimpleEvent', data_string )     
 
 
 
@@ -2,6 +2,10 @@
 # -*- coding: cp1251 -*- 
 
 import socket     
+import select
+
+from journal import Journal, OUT, IN
+from clock import monotonic
 
 '''     
 import struct     
@@ -17,9 +21,75 @@ class SocketException( exceptions.Exception ) :
     
 '''
 
+#
+# the transport profiles ( see Socket.set_profile() and threaded.Netstation ) :
+#     'nodelay'  -- TCP_NODELAY : a small 'D' message is not held back by Nagle's algorithm ;
+#     'sndbuf', 'rcvbuf' -- the kernel buffer sizes ( None -- the system default ) ;
+#     'quickack' -- acknowledge every read at once ( TCP_QUICKACK, where the system has it ) : when several
+#                   responses are outstanding, a server using Nagle's algorithm holds the next one back
+#                   until the previous one is acknowledged, and a delayed ACK takes up to 40 ms ;
+#     'coalesce' -- the window ( in seconds ) within which the markers queued one after another
+#                   are sent with one write ( by the 'postman' thread, see threaded._Batch ) .
+#
+
+PROFILES = {
+    # as the socket comes
+    'default'    : { 'nodelay' : False, 'sndbuf' : None, 'rcvbuf' : None, 'quickack' : False, 'coalesce' : 0.0 },
+    # every marker goes out at once, nothing queues up in the kernel
+    'latency'    : { 'nodelay' : True, 'sndbuf' : 16384, 'rcvbuf' : 16384, 'quickack' : False, 'coalesce' : 0.0 },
+    # a burst of markers is one write and one wait for the responses, at the cost of up to the window per marker
+    'throughput' : { 'nodelay' : True, 'sndbuf' : 262144, 'rcvbuf' : 65536, 'quickack' : True, 'coalesce' : 0.002 },
+}
+
+
+def profile( name ) :
+    """ the settings of the named transport profile ( ValueError for an unknown one ) """
+
+    try :
+        return PROFILES[ name ]
+    except KeyError :
+        raise ValueError( "the transport profile is one of %s, not %r" % ( ", ".join( sorted( PROFILES ) ), name ) )
+
+
 class Socket :
     """ wrap the socket() class """
 
+    #
+    # the responses are received with recv_into() into a preallocated ring buffer
+    # and handed out from there, so reading a 'Z' and then the next response
+    # does not cost a system call per byte ; the writes go out with sendall() .
+    #
+    # With the timeouts ( see set_timeouts() ) a write that makes no progress raises socket.timeout ,
+    # and so does fill_to() at its deadline -- the bytes received so far stay buffered .
+    #
+
+    def __init__( self, buffer_size = 4096, nodelay = False, read_timeout = None, write_timeout = None ) :
+
+        self._rbuf = bytearray( buffer_size )
+        self._rview = memoryview( self._rbuf )
+
+        self._head = 0  # the first unread byte
+        self._count = 0 # the number of the unread bytes
+
+        self._nodelay = nodelay
+
+        # the kernel buffer sizes ( None -- the system default )
+        self._sndbuf = None
+        self._rcvbuf = None
+
+        # re-armed after every read ( Linux resets it ) ; None -- not used
+        self._quickack = None
+
+        # in seconds, None -- wait forever
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+
+        # the traffic journal ( see capture() )
+        self._journal = None
+
+        # the monotonic time of the last completed write ( for the latency statistics )
+        self.last_write = None
+
     def connect( self, str_address, port_no ):
         """ connect to the given host at the specified port ) """
 
@@ -31,36 +101,219 @@ class Socket :
                                       socket.SOCK_STREAM )
         self._socket.connect(  ( str_address, port_no )  )     
 
-        ## self._connection = self._socket.makefile('rw', 0) # read and write, no internal buffer     
-        self._connection = self._socket.makefile('rwb', 0) # read and write, no internal buffer     
+        self._head = 0
+        self._count = 0
+
+        self.set_nodelay( self._nodelay )
+        self.set_buffers( self._sndbuf, self._rcvbuf )
+        self.set_timeouts( self.read_timeout, self.write_timeout )
 
     def disconnect( self ):
         """ close the connection """
 
-        self._connection.close()     
-
-        # is this also nessesary?     
         self._socket.close()
 
-        del self._connection     
         del self._socket     
 
+        if self._journal is not None :
+            self._journal.flush()
+
+    def set_nodelay( self, flag = True ) :
+        """ switch Nagle's algorithm off ( flag = True ) or on for the connection """
+
+        self._nodelay = flag
+
+        if hasattr( self, '_socket' ) :
+            self._socket.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, int( bool( flag ) ) )
+
+    def set_buffers( self, sndbuf = None, rcvbuf = None ) :
+        """ the kernel send / receive buffer sizes for the connection ( None leaves the size as it is ) """
+
+        self._sndbuf = sndbuf
+        self._rcvbuf = rcvbuf
+
+        if not hasattr( self, '_socket' ) :
+            return
+
+        if sndbuf is not None :
+            self._socket.setsockopt( socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf )
+
+        if rcvbuf is not None :
+            self._socket.setsockopt( socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf )
+
+    def set_profile( self, name ) :
+        """ apply the socket part of a transport profile ( see PROFILES ) ; returns its settings """
+
+        settings = profile( name )
+
+        self.set_nodelay( settings[ 'nodelay' ] )
+        self.set_buffers( settings[ 'sndbuf' ], settings[ 'rcvbuf' ] )
+
+        self._quickack = None
+        if settings[ 'quickack' ] :
+            self._quickack = getattr( socket, 'TCP_QUICKACK', None )
+
+        return settings
+
+    def set_timeouts( self, read_timeout = None, write_timeout = None ) :
+        """
+            'read_timeout' -- the time the caller allows for a response ( the deadline is its to pass to fill_to() ) ;
+            'write_timeout' -- how long a write may make no progress ( the socket timeout )
+        """
+
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+
+        if hasattr( self, '_socket' ) :
+            self._socket.settimeout( write_timeout )
+
+    def capture( self, path ) :
+        """ append everything written and received to a journal file ( see journal.py ) ; None stops capturing """
+
+        if self._journal is not None :
+            self._journal.close()
+            self._journal = None
+
+        if path is not None :
+            self._journal = Journal( path )
+
+    ## -----------------------------------------------------------
+
     def write( self, data ) :
-        """ write to the socket -- the socket must be opened """
+        """ write to the socket -- the socket must be opened ; any buffer object will do """
+
+        self._socket.sendall( data )
+        self.last_write = monotonic()
+
+        if self._journal is not None :
+            self._journal.record( OUT, data )
 
-        self._connection.write( data )     
-        ## self._connection.flush( data )     
+
+    def _fill( self ) :
+        """ receive whatever has arrived into the free part of the ring ; returns the number of the new bytes """
+
+        size = len( self._rbuf )
+
+        if self._count == size :
+
+            # make some room : double the buffer and unroll the ring
+            data = self._take( self._count )
+            self._rbuf = bytearray( 2 * size )
+            self._rview = memoryview( self._rbuf )
+            self._rbuf[ : len( data ) ] = data
+            self._head = 0
+            self._count = len( data )
+            size = len( self._rbuf )
+
+        tail = ( self._head + self._count ) % size
+
+        # the free space is contiguous up to the end of the buffer or up to the head
+        if tail >= self._head :
+            n = size - tail
+        else :
+            n = self._head - tail
+
+        try :
+            received = self._socket.recv_into( self._rview[ tail : tail + n ], n )
+        except socket.timeout :
+            # ( the write timeout of the socket : the deadlines of the reads are kept by fill_to() )
+            return None
+
+        if self._quickack is not None :
+            self._socket.setsockopt( socket.IPPROTO_TCP, self._quickack, 1 )
+
+        self._count += received
+
+        if self._journal is not None and received > 0 :
+            self._journal.record( IN, self._rview[ tail : tail + received ].tobytes() )
+
+        return received
+
+
+    def _take( self, size ) :
+        """ remove 'size' bytes from the ring and return them as a string """
+
+        head = self._head
+        end = head + size
+        capacity = len( self._rbuf )
+
+        if end <= capacity :
+            data = self._rview[ head : end ].tobytes()
+        else :
+            data = self._rview[ head : ].tobytes() + self._rview[ : end - capacity ].tobytes()
+
+        self._count -= size
+
+        # start over from the beginning when empty, to keep the free space in one piece
+        if self._count == 0 :
+            self._head = 0
+        else :
+            self._head = end % capacity
+
+        return data
 
 
     def read( self, size = -1 ) :
-        """ read from the socket; warning -- it blocks on reading! """
+        """ read from the socket; warning -- it blocks on reading! ( see fill_to() for reading with a deadline ) """
 
         if size < 0 :
 
-            return self._connection.read()
+            # everything up to the end of the stream
+            while self._fill() != 0 :
+                pass
 
-        else :
+            return self._take( self._count )
+
+        if not self.fill_to( size ) :
+
+            # the connection is closed : return what is left ( as file.read() would do )
+            return self._take( self._count )
+
+        return self._take( size )
+
+
+    def fill_to( self, size, deadline = None ) :
+        """
+            wait until at least 'size' bytes are buffered ( nothing is taken ) ; False if the stream ends first ;
+            raises socket.timeout at the 'deadline' ( in the monotonic seconds, see clock.monotonic() ) --
+            -- the bytes received so far stay buffered, so the reading can go on later
+        """
+
+        while self._count < size :
+
+            if deadline is not None :
+
+                remaining = deadline - monotonic()
+
+                if remaining <= 0 or not select.select( [ self._socket ], [], [], remaining )[0] :
+                    raise socket.timeout( "%d of %d bytes received in time" % ( self._count, size ) )
+
+            if self._fill() == 0 :
+                return False
 
-            return self._connection.read( size )     
+        return True
+
+
+    def peek( self ) :
+        """ the first unread byte ( something must be buffered ) """
+
+        return chr( self._rbuf[ self._head ] )
+
+
+    def buffered( self ) :
+        """ the number of the received bytes not read yet """
+
+        return self._count
 
     
+    def poll( self, timeout = 0 ) :
+        """ is there anything to read ? ( waits up to 'timeout' seconds ) """
+
+        if self._count > 0 :
+            return True
+
+        readable, writable, failed = select.select( [ self._socket ], [], [], timeout )
+
+        return len( readable ) > 0
+
+    
\ No newline at end of file
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+    An append-only spool file for the commands that cannot be sent right now .
+
+    The items are pickled and appended with a length prefix ; they are read back
+    in the same order . Once everything has been read, the file is truncated .
+
+"""
+
+import cPickle
+import os
+import struct
+import tempfile
+
+# -----------------------------------------------------------------------------
+
+_length = struct.Struct( '=L' )
+
+class Spool :
+    """ a FIFO of picklable items kept in a file """
+
+    def __init__( self, path = None ) :
+        """ with no path a temporary file is created ( and kept, so nothing is lost on a crash ; see close() ) """
+
+        # ( created here, so removed by close() when nothing is left in it )
+        self.temporary = path is None
+
+        if path is None :
+            fd, path = tempfile.mkstemp( prefix = 'egi-spool-', suffix = '.bin' )
+            os.close( fd )
+
+        self.path = path
+
+        self._file = open( path, 'a+b' )
+        self._read_offset = 0
+        self._count = 0
+
+        # the item read by peek() and its size in the file
+        self._peeked = None
+
+    def __len__( self ) :
+
+        return self._count
+
+    def append( self, item ) :
+
+        data = cPickle.dumps( item, cPickle.HIGHEST_PROTOCOL )
+
+        self._file.seek( 0, os.SEEK_END )
+        self._file.write( _length.pack( len( data ) ) )
+        self._file.write( data )
+        self._file.flush()
+
+        self._count += 1
+
+    def peek( self ) :
+        """ the oldest item, left in the spool """
+
+        if self._count == 0 :
+            raise IndexError( "the spool is empty" )
+
+        if self._peeked is None :
+
+            self._file.seek( self._read_offset )
+            size = _length.unpack( self._file.read( _length.size ) )[0]
+            item = cPickle.loads( self._file.read( size ) )
+
+            self._peeked = ( item, _length.size + size )
+
+        return self._peeked[0]
+
+    def pop( self ) :
+        """ remove the oldest item and return it """
+
+        item = self.peek()
+
+        self._read_offset += self._peeked[1]
+        self._peeked = None
+        self._count -= 1
+
+        if self._count == 0 :
+
+            # everything has been read : start the file over
+            self._file.truncate( 0 )
+            self._read_offset = 0
+
+        return item
+
+    def close( self, remove = None ) :
+        """
+            close the file and remove it if 'remove' -- by default, if it is a temporary one and empty ;
+            a file with items left in it stays where it is ( see self.path ) ; returns True if removed
+        """
+
+        self._file.close()
+
+        if remove is None :
+            remove = self.temporary and self._count == 0
+
+        if remove :
+            os.remove( self.path )
+
+        return remove
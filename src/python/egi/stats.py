@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+    Latency statistics of the commands going through a Netstation client .
+
+    Every command is stamped when it is queued, when the worker takes it, when it has been
+    written to the socket and when the response has come back ; CommandStats keeps the last
+    stamps in a ring and folds the stage durations into histograms .
+
+    The histograms are HDR-style : log-linear buckets with a fixed relative precision
+    ( 1/32, about 3 % ), so recording is O(1) and the memory does not grow with the count .
+
+"""
+
+import collections
+import threading
+
+# -----------------------------------------------------------------------------
+
+class Histogram :
+    """ microsecond values in log-linear buckets : exact below 32 us, within ~3 % above """
+
+    _sub_bits = 5
+    _sub_count = 1 << _sub_bits
+
+    def __init__( self ) :
+
+        self.reset()
+
+    def reset( self ) :
+
+        self._counts = collections.defaultdict( int )
+
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    ## -----------------------------------------------------------
+
+    @classmethod
+    def _index( cls, value ) :
+
+        if value < cls._sub_count :
+            return value
+
+        shift = value.bit_length() - cls._sub_bits - 1
+        return ( shift + 1 ) * cls._sub_count + ( value >> shift ) - cls._sub_count
+
+    @classmethod
+    def _lower( cls, index ) :
+        """ the smallest value of the bucket """
+
+        if index < cls._sub_count :
+            return index
+
+        shift = index // cls._sub_count - 1
+        return ( cls._sub_count + index % cls._sub_count ) << shift
+
+    ## -----------------------------------------------------------
+
+    def record( self, us ) :
+        """ add a value, in microseconds """
+
+        us = max( 0, int( us ) )
+
+        self._counts[ self._index( us ) ] += 1
+
+        self.count += 1
+        self.total += us
+
+        if self.min is None or us < self.min : self.min = us
+        if self.max is None or us > self.max : self.max = us
+
+    def mean( self ) :
+
+        if not self.count :
+            return None
+
+        return float( self.total ) / self.count
+
+    def percentile( self, p ) :
+        """ the value ( the middle of its bucket ) below which 'p' percent of the values are """
+
+        if not self.count :
+            return None
+
+        if p >= 100 :
+            return self.max
+
+        rank = max( 1, int( round( self.count * p / 100.0 ) ) )
+        seen = 0
+
+        for index in sorted( self._counts ) :
+
+            seen += self._counts[ index ]
+
+            if seen >= rank :
+                low, high = self._lower( index ), self._lower( index + 1 )
+                return min( self.max, ( low + high - 1 ) / 2.0 )
+
+        return self.max
+
+
+# -----------------------------------------------------------------------------
+
+class CommandStats :
+    """
+        the stamps of the recent commands and the histograms of the stages ( all in microseconds ) :
+            'queue' -- from queuing to being taken by the worker ,
+            'write' -- from being taken to being written to the socket ,
+            'ack'   -- from being written to the response ,
+            'total' -- from queuing to the response .
+        The worker records, any thread may read ; the errors are counted per command name .
+    """
+
+    stages = ( 'queue', 'write', 'ack', 'total' )
+
+    def __init__( self, ring_size = 1024 ) :
+
+        self._lock = threading.Lock()
+
+        # ( name, t_queued, t_taken, t_written, t_acked, ok ) -- the monotonic seconds
+        self.ring = collections.deque( maxlen = ring_size )
+
+        self.reset()
+
+    def reset( self ) :
+        """ start over ( e.g. at a block boundary ) ; the ring is kept """
+
+        with self._lock :
+
+            self.histograms = dict( ( stage, Histogram() ) for stage in self.stages )
+            self.commands = 0
+            self.errors = collections.defaultdict( int )
+
+    def record( self, name, t_queued, t_taken, t_written, t_acked, ok = True ) :
+        """ the stamps of a completed command ; 't_written' may be None ( nothing was written ) """
+
+        if t_written is None :
+            t_written = t_taken
+
+        with self._lock :
+
+            self.ring.append( ( name, t_queued, t_taken, t_written, t_acked, ok ) )
+
+            self.commands += 1
+            if not ok :
+                self.errors[ name ] += 1
+
+            self.histograms[ 'queue' ].record( ( t_taken - t_queued ) * 1e6 )
+            self.histograms[ 'write' ].record( ( t_written - t_taken ) * 1e6 )
+            self.histograms[ 'ack' ].record( ( t_acked - t_written ) * 1e6 )
+            self.histograms[ 'total' ].record( ( t_acked - t_queued ) * 1e6 )
+
+    ## -----------------------------------------------------------
+
+    def snapshot( self ) :
+        """ a plain summary : the counts, the errors and, per stage, the percentiles in ms """
+
+        ms = lambda us : None if us is None else us / 1000.0
+
+        with self._lock :
+
+            summary = { 'commands' : self.commands, 'errors' : dict( self.errors ) }
+
+            for stage in self.stages :
+
+                h = self.histograms[ stage ]
+
+                summary[ stage ] = { 'count' : h.count,
+                                     'mean' : ms( h.mean() ),
+                                     'p50' : ms( h.percentile( 50 ) ),
+                                     'p90' : ms( h.percentile( 90 ) ),
+                                     'p99' : ms( h.percentile( 99 ) ),
+                                     'max' : ms( h.max ) }
+
+        return summary
+
+    def report( self, queue_depth = None ) :
+        """ the snapshot as a few lines of text """
+
+        summary = self.snapshot()
+
+        lines = [ "%d commands, %d errors%s%s" % ( summary[ 'commands' ],
+                                                   sum( summary[ 'errors' ].values() ),
+                                                   "".join( " (%s: %d)" % item for item in sorted( summary[ 'errors' ].items() ) ),
+                                                   "" if queue_depth is None else ", %d queued" % ( queue_depth, ) ) ]
+
+        for stage in self.stages :
+
+            s = summary[ stage ]
+            if not s[ 'count' ] : continue
+
+            lines.append( "  %-5s  p50 %8.3f  p90 %8.3f  p99 %8.3f  max %8.3f ms" % ( stage, s[ 'p50' ], s[ 'p90' ], s[ 'p99' ], s[ 'max' ] ) )
+
+        return "\n".join( lines )
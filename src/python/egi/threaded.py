@@ -19,6 +19,10 @@ from socket_wrapper import Socket
 
 Error = internal.Eggog     
 ms_localtime = internal.ms_localtime     
+marker_clock = internal.marker_clock
+SyncPolicy = internal.SyncPolicy
+ResponseTimeout = internal.ResponseTimeout
+WriteTimeout = internal.WriteTimeout
 
 #
 # the name(s) to be used internally     
@@ -32,14 +36,129 @@ ms_localtime = internal.ms_localtime
 
 # -----------------------------------------------------------------------------
 
-from threading import Thread     
-from Queue import Queue
+from threading import Thread, Event, Lock, Condition     
+from Queue import Empty
+from collections import deque
+
+import socket # socket.error
+from spool import Spool
+from stats import CommandStats
+from clock import monotonic
 
 import time # time() for 'soft timeouts'     
 
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
 
+class Timeout( internal.Eggog ) :
+    """ a command has not completed in time """
+
+    pass
+
+
+class Request :
+    """
+        the outcome of a queued command : completed by the 'postman' thread ,
+        can be waited for ( from any thread ), given callbacks or just ignored ;
+
+        cheap to make on the stimulus thread : no Event until someone waits for it ,
+        and one lock shared by all the requests ( held for a few assignments only )
+    """
+
+    _lock = Lock()
+
+    def __init__( self, name ) :
+
+        self.name = name
+
+        self._done = False
+        self._result = None
+        self._error = None
+
+        self._event = None
+        self._callbacks = None
+
+    def done( self ) :
+
+        return self._done
+
+    def wait( self, timeout = None ) :
+        """ wait until the command is completed ; False if the timeout has expired first """
+
+        if self._done :
+            return True
+
+        with self._lock :
+
+            if self._done :
+                return True
+
+            if self._event is None :
+                self._event = Event()
+
+        return self._event.wait( timeout )
+
+    def result( self, timeout = None ) :
+        """ the result of the command ; raises its error, or Timeout if it is not completed in time """
+
+        if not self.wait( timeout ) :
+            raise Timeout( "'%s' has not completed in %s s" % ( self.name, timeout ) )
+
+        if self._error is not None :
+            raise self._error
+
+        return self._result
+
+    def exception( self, timeout = None ) :
+        """ the error of the command ( None if it has succeeded ) """
+
+        if not self.wait( timeout ) :
+            raise Timeout( "'%s' has not completed in %s s" % ( self.name, timeout ) )
+
+        return self._error
+
+    def add_done_callback( self, fn ) :
+        """ fn( request ) is called when the command is completed -- in the 'postman' thread ( or right now, if done ) """
+
+        with self._lock :
+
+            if not self._done :
+
+                if self._callbacks is None :
+                    self._callbacks = []
+
+                self._callbacks.append( fn )
+                return
+
+        fn( self )
+
+    ## -----------------------------------------------------------
+
+    def _finish( self, result = None, error = None ) :
+
+        with self._lock :
+
+            if self._done : return
+
+            self._result = result
+            self._error = error
+            self._done = True
+
+            callbacks, self._callbacks = self._callbacks, None
+
+        # ( only made if someone is waiting ; set outside the lock, it has its own )
+        if self._event is not None :
+            self._event.set()
+
+        for fn in callbacks or () :
+
+            # a failing callback must not stop the 'postman'
+            try :
+                fn( self )
+            except Exception, e :
+                print " egi: a callback for '%s' has failed (%s) " % ( self.name, e )
+
+
 # 
 # an internal helper class -- a very thin wrapper around 'a message' between two threads     
 # 
@@ -63,6 +182,21 @@ class _Command :
         self._func_name = method_name     
         self._kwargs = kwargs
 
+        self.future = Request( method_name )
+
+        # the first of the stamps ( see _NetstationThread._process() )
+        self.t_queued = monotonic()
+
+    # the future stays in memory when the command is spooled
+    def __getstate__( self ) :
+
+        return { '_func_name' : self._func_name, '_kwargs' : self._kwargs, 't_queued' : self.t_queued }
+
+    def __setstate__( self, state ) :
+
+        self.__dict__.update( state )
+        self.future = None
+
     # (2) " unpacking " :     
 
     def name( self ) :
@@ -105,17 +239,653 @@ class _Command :
     
         
 
+class _Batch( _Command ) :
+    """
+        the markers the 'postman' has taken together within the coalescing window ( see the
+        'throughput' transport profile ) : one write, then the responses -- each of them
+        completes the future of its own marker
+    """
+
+    def __init__( self, packets ) :
+
+        _Command.__init__( self, 'send_events', { 'events' : [ p.kwargs() for p in packets ] } )
+
+        self.t_queued = packets[0].t_queued
+
+        # the queuing times of the markers ( for the statistics, see _NetstationThread._record() )
+        self.stamps = [ p.t_queued for p in packets ]
+
+        futures = [ p.future for p in packets ]
+
+        # ( a closure, not a method : the callback stays with the future when the batch is spooled )
+        def _distribute( request ) :
+
+            error = request.exception()
+
+            for i, future in enumerate( futures ) :
+
+                result = error or request._result[ i ]
+
+                if isinstance( result, Exception ) :
+                    future._finish( error = result )
+                else :
+                    future._finish( result = result )
+
+        self.future.add_done_callback( _distribute )
+
+    def __getstate__( self ) :
+
+        state = _Command.__getstate__( self )
+        state[ 'stamps' ] = self.stamps
+
+        return state
+        
+
+# -----------------------------------------------------------------------------
+
+class QueueFull( internal.Eggog ) :
+    """ the command queue is full ( see the 'overflow' policies of Netstation ) """
+
+    pass
+
+
+class _LaneQueue :
+    """
+        the 'to-send' queue with two FIFO lanes : the control commands are taken
+        before the markers ( and everything else ), so a sync does not wait behind
+        a backlog of events ; nothing is reordered within a lane, and a marker
+        queued after a sync can never overtake it .
+
+        StopRecording / EndSession ( and the end marker ) stay in the bulk lane ,
+        so they come after the markers queued before them ; while one of them is queued ,
+        the control commands go to the bulk lane too, so nothing overtakes the end of
+        a recording or a session .
+
+        The bulk lane may be bounded by a 'capacity' ; when it is full, the 'overflow' policy is
+            'block'       -- put() waits for room, up to 'timeout' seconds ( None -- forever ) ,
+                             then raises QueueFull ;
+            'drop-oldest' -- the oldest queued marker is dropped ( its future fails with QueueFull ) ;
+            'spill'       -- the commands go to a spool file ( 'spill_path' ) and come back in order .
+        The control commands, StopRecording / EndSession and the end marker are never refused
+        ( nor dropped ) : they go over the capacity, if need be .
+
+        The part of the Queue interface the 'postman' thread uses .
+    """
+
+    # the commands that may overtake the queued markers
+    priority = ( 'BeginSession', 'StartRecording', 'sync', 'SendAttentionCommand', 'SendLocalTime' )
+
+    # the commands the control ones must not overtake
+    closing = ( 'StopRecording', 'EndSession' )
+
+    # the commands the 'drop-oldest' policy may drop
+    droppable = ( 'send_event', 'send_events', 'send_template' )
+
+    overflow_policies = ( 'block', 'drop-oldest', 'spill' )
+
+    def __init__( self, capacity = None, overflow = 'block', timeout = None, spill_path = None ) :
+
+        if overflow not in self.overflow_policies :
+            raise ValueError( "the overflow policy is one of %s, not %r" % ( ", ".join( self.overflow_policies ), overflow ) )
+
+        self.capacity = capacity
+        self.overflow = overflow
+        self.timeout = timeout
+
+        self._control = deque()
+        self._bulk = deque()
+
+        self._lock = Lock()
+        self._ready = Condition( self._lock )
+        self._room = Condition( self._lock )
+
+        # created on the first overflow with the 'spill' policy
+        self._spill = None
+        self._spill_path = spill_path
+        self._spilled_futures = deque()
+
+        # the overflow counters
+        self.dropped = 0
+        self.spilled = 0
+        self.refused = 0
+
+        self._overflowing = False
+
+        # the closing session commands in the bulk lane ( or spilled )
+        self._closing = 0
+
+        # the consumer waits for a packet / the producers wait for room ( so put() and get() notify only then )
+        self._sleeping = 0
+        self._blocked = 0
+
+    ## -----------------------------------------------------------
+
+    def put( self, packet ) :
+        """ queue the packet ; returns the packet actually queued ( a sync may be merged into a pending one ) """
+
+        victim = None
+
+        name = packet is not None and packet._func_name
+
+        with self._lock :
+
+            # the common case first : a marker, room for it and nothing spilled
+            if name in self.droppable and ( self.capacity is None or len( self._bulk ) < self.capacity ) \
+               and ( self._spill is None or not len( self._spill ) ) :
+
+                self._bulk.append( packet )
+
+                # ( the consumer is woken only if it sleeps )
+                if self._sleeping :
+                    self._ready.notify()
+
+                return packet
+
+            if name == 'sync' :
+
+                pending = self._pending_sync( packet )
+                if pending is not None :
+                    return pending
+
+            if name in self.priority and not self._closing :
+                self._control.append( packet )
+
+            elif name in self.priority or name in self.closing :
+
+                # ( behind everything queued so far -- over the capacity, if need be )
+                if self._spilling() :
+                    self._spill_one( packet )
+                else :
+                    self._bulk.append( packet )
+
+                if name in self.closing :
+                    self._closing += 1
+
+            else :
+                victim = self._admit( packet )
+
+            if self._sleeping :
+                self._ready.notify()
+
+        # ( outside the lock : the callbacks of the future may queue more commands )
+        if victim is not None :
+            victim.future._finish( error = QueueFull( "'%s' is dropped : the command queue is full" % ( victim.name(), ) ) )
+
+        return packet
+
+    def _admit( self, packet ) :
+        """ put the packet in the bulk lane according to the overflow policy ; returns the dropped packet, if any """
+
+        if self._spilling() :
+            self._spill_one( packet )
+            return None
+
+        if self.capacity is None or packet is None or len( self._bulk ) < self.capacity :
+            self._bulk.append( packet )
+            return None
+
+        self._overflowed()
+
+        if self.overflow == 'block' :
+
+            self._wait_for_room()
+            self._bulk.append( packet )
+
+            return None
+
+        if self.overflow == 'spill' :
+
+            self._spill_one( packet )
+            return None
+
+        # 'drop-oldest' : normally the very first one
+        for victim in self._bulk :
+
+            if victim is not None and victim.name() in self.droppable :
+
+                self._bulk.remove( victim )
+                self._bulk.append( packet )
+                self.dropped += 1
+
+                return victim
+
+        # nothing to drop ( only the commands that must not be lost are queued )
+        self._bulk.append( packet )
+
+        return None
+
+    def _wait_for_room( self ) :
+
+        if self.timeout is None :
+
+            while len( self._bulk ) >= self.capacity :
+                self._wait( self._room, None )
+
+            return
+
+        deadline = time.time() + self.timeout
+
+        while len( self._bulk ) >= self.capacity :
+
+            remaining = deadline - time.time()
+            if remaining <= 0 :
+                self.refused += 1
+                raise QueueFull( "the command queue is full ( %d commands ) for %s s" % ( len( self._bulk ), self.timeout ) )
+
+            self._wait( self._room, remaining )
+
+    def _wait( self, condition, timeout ) :
+        """ wait on one of the conditions ( the lock is held ) , counted so the other side notifies only a sleeper """
+
+        if condition is self._ready :
+            self._sleeping += 1
+        else :
+            self._blocked += 1
+
+        try :
+            condition.wait( timeout )
+        finally :
+            if condition is self._ready :
+                self._sleeping -= 1
+            else :
+                self._blocked -= 1
+
+    def _overflowed( self ) :
+
+        if not self._overflowing :
+            print " egi: the command queue is full ( %d commands ), the overflow policy is '%s' " % ( self.capacity, self.overflow )
+
+        self._overflowing = True
+
+    ## -----------------------------------------------------------
+
+    def _spilling( self ) :
+
+        return self._spill is not None and len( self._spill ) > 0
+
+    def _spill_one( self, packet ) :
+
+        if self._spill is None :
+            self._spill = Spool( self._spill_path )
+
+        self._spill.append( packet )
+        self._spilled_futures.append( packet is not None and packet.future or None )
+        self.spilled += 1
+
+    def _unspill( self ) :
+        """ bring the spilled commands back to the bulk lane, as many as there is room for """
+
+        while self._spilling() and ( len( self._bulk ) < self.capacity or not self._bulk ) :
+
+            packet = self._spill.pop()
+            future = self._spilled_futures.popleft()
+
+            if packet is not None :
+                packet.future = future
+
+            self._bulk.append( packet )
+
+    def close( self ) :
+        """ once nothing takes from the queue : close the spill file ( removed if it is a temporary one and empty ) """
+
+        if self._spill is None :
+            return
+
+        left = len( self._spill )
+
+        if not self._spill.close() and left :
+            print " egi: %d commands could not be sent, they are left in '%s' " % ( left, self._spill.path )
+
+    ## -----------------------------------------------------------
+
+    def _pending_sync( self, packet ) :
+        """ a queued sync the new one is redundant with ( a forced one makes it forced ) """
+
+        new = packet.kwargs()
+
+        if new[ 'timestamp' ] is not None :
+            return None
+
+        for pending in self._control :
+
+            old = pending.kwargs()
+
+            if pending.name() == 'sync' and old[ 'timestamp' ] is None and old[ 'rounds' ] == new[ 'rounds' ] :
+
+                old[ 'force' ] = old[ 'force' ] or new[ 'force' ]
+                return pending
+
+        return None
+
+    def _empty( self ) :
+
+        return not ( self._control or self._bulk or self._spilling() )
+
+    def get( self, block = True, timeout = None ) :
+
+        with self._lock :
+
+            if block and timeout is None :
+
+                while self._empty() :
+                    self._wait( self._ready, None )
+
+            elif block :
+
+                deadline = time.time() + timeout
+
+                while self._empty() :
+
+                    remaining = deadline - time.time()
+                    if remaining <= 0 :
+                        raise Empty
+
+                    self._wait( self._ready, remaining )
+
+            elif self._empty() :
+                raise Empty
+
+            if self._control :
+                return self._control.popleft()
+
+            if not self._bulk :
+                self._unspill()
+
+            packet = self._bulk.popleft()
+
+            if packet is not None and packet.name() in self.closing :
+                self._closing -= 1
+
+            self._unspill()
+
+            # ( the warning is repeated once the queue has got well below the capacity )
+            if self.capacity is not None and len( self._bulk ) <= self.capacity // 2 and not self._spilling() :
+                self._overflowing = False
+
+            if self._blocked :
+                self._room.notify()
+
+            return packet
+
+    def qsize( self ) :
+
+        depth = len( self._control ) + len( self._bulk )
+
+        if self._spill is not None :
+            depth += len( self._spill )
+
+        return depth
+        
+
+class _Ring :
+    """
+        the 'to-send' queue as a single-producer / single-consumer ring of preallocated slots :
+        the producer only moves the tail, the consumer only moves the head, so neither takes
+        a lock while there is something to take and room to put it ; the wakeup events are
+        set only when the other side is actually asleep .
+
+        All the commands must be queued from one thread ( the experiment loop ) ; they are
+        sent strictly in that order -- no lanes, no merging of the syncs ( see _LaneQueue ) .
+        When the ring is full, put() waits for room, up to 'timeout' seconds ( None -- forever ) ,
+        then raises QueueFull ; the end marker takes no slot ( a flag, taken once the ring is empty ) ,
+        so it never waits -- finalize() cannot hang on a stuck 'postman' .
+
+        The part of the Queue interface the 'postman' thread uses .
+    """
+
+    # the counters of _LaneQueue, for Netstation.queue_stats()
+    overflow = 'block'
+    dropped = 0
+    spilled = 0
+
+    def __init__( self, size = 1024, timeout = None ) :
+
+        # ( a power of two : the slot of a position is a mask away )
+        slots = 2
+        while slots < size :
+            slots *= 2
+
+        self.capacity = slots
+        self.timeout = timeout
+        self.refused = 0
+
+        self._slots = [ None ] * slots
+        self._mask = slots - 1
+
+        # the positions grow forever : the tail is written by the producer only, the head by the consumer only
+        self._head = 0
+        self._tail = 0
+
+        self._ready = Event()
+        self._consumer_waiting = False
+
+        self._room = Event()
+        self._producer_waiting = False
+
+        # the end marker, set by the producer after its last packet
+        self._end = False
+
+    ## -----------------------------------------------------------
+
+    def put( self, packet ) :
+        """ queue the packet ( the producer thread only ) ; returns it """
+
+        if packet is None :
+
+            self._end = True
+
+            if self._consumer_waiting :
+                self._consumer_waiting = False
+                self._ready.set()
+
+            return packet
+
+        tail = self._tail
+
+        if tail - self._head > self._mask :
+            self._wait_for_room( self.timeout )
+
+        self._slots[ tail & self._mask ] = packet
+        self._tail = tail + 1
+
+        # ( the flag is read after the tail is moved, the consumer sets it before looking at the tail again ;
+        #   cleared here, so it is one wakeup per sleep )
+        if self._consumer_waiting :
+            self._consumer_waiting = False
+            self._ready.set()
+
+        return packet
+
+    def _wait_for_room( self, timeout ) :
+
+        if timeout is not None :
+            deadline = time.time() + timeout
+
+        while self._tail - self._head > self._mask :
+
+            self._room.clear()
+            self._producer_waiting = True
+
+            if self._tail - self._head > self._mask :
+
+                if timeout is None :
+                    self._room.wait()
+                else :
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or not self._room.wait( remaining ) and self._tail - self._head > self._mask :
+                        self._producer_waiting = False
+                        self.refused += 1
+                        raise QueueFull( "the command ring is full ( %d commands ) for %s s" % ( self.capacity, timeout ) )
+
+            self._producer_waiting = False
+
+    ## -----------------------------------------------------------
+
+    def get( self, block = True, timeout = None ) :
+        """ take the next packet ( the consumer thread only ) """
+
+        head = self._head
+
+        if head == self._tail :
+
+            if not self._end :
+
+                if not block :
+                    raise Empty
+
+                self._wait_for_packet( timeout )
+
+            # ( the flag is read before the tail : once it is set, the tail has got to the last packet )
+            if self._end and head == self._tail :
+                self._end = False
+                return None
+
+        slot = head & self._mask
+
+        packet = self._slots[ slot ]
+        self._slots[ slot ] = None
+
+        self._head = head + 1
+
+        # ( the producer is woken when the ring is half empty, so it refills in batches )
+        if self._producer_waiting and self._tail - self._head <= self.capacity // 2 :
+            self._producer_waiting = False
+            self._room.set()
+
+        return packet
+
+    def _wait_for_packet( self, timeout ) :
+
+        if timeout is not None :
+            deadline = time.time() + timeout
+
+        while self._head == self._tail and not self._end :
+
+            self._ready.clear()
+            self._consumer_waiting = True
+
+            if self._head == self._tail and not self._end :
+
+                if timeout is None :
+                    self._ready.wait()
+                else :
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or not self._ready.wait( remaining ) and self._head == self._tail and not self._end :
+                        self._consumer_waiting = False
+                        raise Empty
+
+            self._consumer_waiting = False
+
+    def qsize( self ) :
+        """ the packets in the ring, and the end marker until it is taken """
+
+        return self._tail - self._head + int( self._end )
+
+    def close( self ) :
+        """ nothing to close : the ring is in memory only """
+
+        pass
+
+
+# -----------------------------------------------------------------------------
+
+class _Responses :
+    """
+        the 'received' end of the 'postman' : the results are counted and only the last 'keep'
+        of them are kept to be read, so a long session does not pile up the acknowledgements ;
+        an error ( an 'F' from the server, a broken connection ) goes to 'on_error( name, error )'
+        right away -- in the 'postman' thread, not in the one rendering -- or is printed, if there is no callback .
+
+        The part of the Queue interface Netstation.enumerate_responses() uses .
+    """
+
+    def __init__( self, keep = 256, on_error = None ) :
+
+        self._lock = Lock()
+
+        # ( name, result ) -- the oldest unread ones are forgotten
+        self._recent = deque( maxlen = keep )
+
+        self.on_error = on_error
+
+        self.received = 0
+        self.errors = 0
+        self.last_error = None
+
+    def put( self, response, name = None ) :
+
+        error = isinstance( response, Exception )
+
+        with self._lock :
+
+            self._recent.append( ( name, response ) )
+
+            self.received += 1
+            if error :
+                self.errors += 1
+                self.last_error = ( name, response )
+
+        if not error : return
+
+        if self.on_error is None :
+            print " egi: '%s' has failed (%s) " % ( name, response )
+            return
+
+        # a failing callback must not stop the 'postman'
+        try :
+            self.on_error( name, response )
+        except Exception, e :
+            print " egi: the error callback for '%s' has failed (%s) " % ( name, e )
+
+    def get( self ) :
+        """ the oldest unread result ( not blocking : see qsize() ) """
+
+        with self._lock :
+
+            if not self._recent :
+                raise Empty
+
+            return self._recent.popleft()[1]
+
+    def qsize( self ) :
+
+        return len( self._recent )
+
+    def summary( self ) :
+        """ the counts, the last error and the unread ( name, result ) pairs """
+
+        with self._lock :
+
+            return { 'received' : self.received,
+                     'errors' : self.errors,
+                     'last_error' : self.last_error,
+                     'unread' : list( self._recent ) }
+
+
 # -----------------------------------------------------------------------------
 
 class _NetstationThread( Thread ) :     
 
     """ Class implementing the thread instance that be sending the messages """     
 
-    def __init__( self, to_send, received ) :
+    # the errors meaning that the connection is gone ( as opposed to an 'F' from the server )
+    _broken = ( socket.error, internal.ConnectionLost )
+
+    # not worth keeping while disconnected : a new session is begun and synced on reconnection
+    _not_spooled = ( 'BeginSession', 'sync', 'SendAttentionCommand', 'SendLocalTime' )
+
+    # the commands sending several markers : their result is the list of the results of the markers
+    _batches = ( 'send_events', '_command_batch' )
+
+    def __init__( self, to_send, received, spool = None, max_backoff = 5.0 ) :
         """     
             the thread will send the strings from the 'to_send' queue,
             read the response with the read functions packed together with the strings to send,
-            put the result in the 'received' queue
+            put the result in the 'received' queue ( see _Responses : the result, the name of the command ) ;
+
+            with a 'spool' ( see spool.Spool ) the thread reconnects when the connection breaks ,
+            with the delays growing up to 'max_backoff' seconds, keeping the commands in the spool
+            in the meantime ; they are sent in the original order after the new session is synced .
         """     
 
         Thread.__init__( self )     
@@ -127,6 +897,31 @@ class _NetstationThread( Thread ) :
         self._to_send   =  to_send     
         self._received  =  received     
 
+        self._spool = spool
+        self._spooled_futures = deque()
+
+        # the latency statistics, see stats.py
+        self.stats = CommandStats()
+
+        # the markers queued within this many seconds of each other go out together ( see _coalesce() )
+        self.coalesce = 0.0
+        self.max_batch = 64
+        self._held = deque()
+
+        self._address = None
+        self._connected = False
+
+        # the end marker has been taken ( the thread has stopped as it should )
+        self.finished = False
+
+        # Netstation is recording ( as far as the acknowledged commands go ) : restarted on reconnection
+        self.recording = False
+
+        self._min_backoff = 0.1
+        self._max_backoff = max_backoff
+        self._backoff = self._min_backoff
+        self._next_attempt = 0
+
     ## -----------------------------------------------------------
 
     @staticmethod     
@@ -137,9 +932,73 @@ class _NetstationThread( Thread ) :
 
     
     def _process( self, packet ) :     
-        """ pass the received information to internal 'netstation' object to make a method call """
+        """
+            pass the received information to internal 'netstation' object to make a method call ;
+            the result ( or the server error ) completes the future of the packet and is returned ,
+            a broken connection is raised ; the stamps of the packet go to the statistics
+        """
+
+        t_taken = monotonic()
+
+        socket_object = self._netstation_object._socket
+        socket_object.last_write = None
+
+        try :
+            ret = packet.invoke( self._netstation_object )
+        except self._broken, e :
+            self._record( packet, t_taken, socket_object.last_write, e )
+            raise
+        except internal.Eggog, e :
+            ret = e
+            self._record( packet, t_taken, socket_object.last_write, e )
+            packet.future._finish( error = e )
+        else :
+            self._record( packet, t_taken, socket_object.last_write, ret )
+
+            if packet.name() in ( 'StartRecording', 'StopRecording', 'EndSession' ) :
+                self.recording = packet.name() == 'StartRecording'
+
+            packet.future._finish( result = ret )
+
+        return ret
+
+
+    def _record( self, packet, t_taken, t_written, outcome ) :
+        """ the stamps of the packet go to the statistics -- one entry per marker for a batch """
+
+        t_acked = monotonic()
+
+        if packet.name() not in self._batches :
 
-        return packet.invoke( self._netstation_object )
+            self.stats.record( packet.future.name, packet.t_queued, t_taken, t_written, t_acked, not isinstance( outcome, Exception ) )
+            return
+
+        # ( the markers of an explicit send_events() have all been queued together )
+        stamps = getattr( packet, 'stamps', None )
+        if stamps is None :
+            kwargs = packet.kwargs()
+            stamps = [ packet.t_queued ] * len( kwargs.get( 'events' ) or kwargs.get( 'messages' ) )
+
+        for i, t_queued in enumerate( stamps ) :
+
+            result = outcome
+            if isinstance( outcome, list ) :
+                result = outcome[ i ]
+
+            self.stats.record( 'send_event', t_queued, t_taken, t_written, t_acked, not isinstance( result, Exception ) )
+
+
+    def _report( self, packet, ret ) :
+        """ the result goes to the 'received' end -- one per marker for a batch , so a refused marker is an error """
+
+        if packet.name() in self._batches and isinstance( ret, list ) :
+
+            for result in ret :
+                self._received.put( result, 'send_event' )
+
+            return
+
+        self._received.put( ret, packet.future.name )
         
 
     ## -----------------------------------------------------------
@@ -151,26 +1010,44 @@ class _NetstationThread( Thread ) :
 
         while True :     
 
-            packet = self._to_send.get()     
+            packet = self._coalesce( self._next_packet() )
+
+            if packet is self._retry :
+
+                self._recover()
+                continue
 
             if self.is_end_marker( packet ) :
 
                 # # debug
                 # print self.getName(), " :  we're done ! "     
 
+                self._last_chance()
+                self.finished = True
+
                 # we are assuming that the 'None' "packet" is an absolute "end marker" --
                 # -- so it is safe to disconnect now     
                 self._disconnect()     
                 
                 break     
             
+            if self._spool is not None :
+
+                self._deliver( packet )
+                continue
+            
             # 
             # we could change the packet format and add some timestamps and/or packet numbers ...     
             # 
 
-            ret = self._process( packet )
+            try :
+                ret = self._process( packet )
+            except self._broken, e :
+                # no reconnection : the command has failed, as will the next ones
+                ret = e
+                packet.future._finish( error = e )
 
-            self._received.put( ret ) # also could have added the input timestamp, output timestamp and the packet number     
+            self._report( packet, ret ) # ( the timestamps of the packet are in self.stats )     
 
 
         # # debug
@@ -178,6 +1055,176 @@ class _NetstationThread( Thread ) :
 
     ## -----------------------------------------------------------
 
+    # 
+    # surviving a broken connection ( only with a spool )
+    #
+
+    # returned by _next_packet() when it is time for another reconnection attempt
+    _retry = object()
+
+    def _next_packet( self ) :
+        """ the next command from the queue ; while disconnected, waits no longer than until the next attempt """
+
+        # ( the one that has ended the last batch )
+        if self._held :
+            return self._held.popleft()
+
+        if self._spool is None or ( self._connected and not len( self._spool ) ) :
+            return self._to_send.get()
+
+        try :
+            return self._to_send.get( timeout = max( 0, self._next_attempt - time.time() ) )
+        except Empty :
+            return self._retry
+
+
+    def _coalesce( self, packet ) :
+        """
+            with a coalescing window, the markers queued within it after this one are taken too
+            and sent as one batch ( see _Batch ) ; the first other command ends the batch and goes next
+        """
+
+        if not self.coalesce or packet is None or packet is self._retry or packet.name() != 'send_event' :
+            return packet
+
+        batch = [ packet ]
+        deadline = monotonic() + self.coalesce
+
+        while len( batch ) < self.max_batch :
+
+            try :
+                more = self._to_send.get( timeout = max( 0, deadline - monotonic() ) )
+            except Empty :
+                break
+
+            if more is None or more.name() != 'send_event' :
+                self._held.append( more )
+                break
+
+            batch.append( more )
+
+        if len( batch ) == 1 :
+            return packet
+
+        return _Batch( batch )
+
+
+    def _deliver( self, packet ) :
+        """ send the packet, or keep it in the spool if it cannot be sent now """
+
+        if self._connected and not len( self._spool ) :
+
+            try :
+                self._report( packet, self._process( packet ) )
+                return
+            except self._broken, e :
+                # nb. the command may have reached Netstation before the connection broke --
+                #     it is sent once again anyway ( better twice than never )
+                self._lost( e )
+
+        if packet.name() in self._not_spooled :
+            packet.future._finish( error = internal.ConnectionLost( "'%s' is dropped while disconnected" % ( packet.name(), ) ) )
+            return
+
+        self._spool.append( packet )
+        self._spooled_futures.append( packet.future )
+        self._recover()
+
+
+    def _lost( self, error ) :
+
+        print " egi: the connection is lost (%s), spooling the commands to '%s' " % ( error, self._spool.path )
+
+        self._connected = False
+        self._backoff = self._min_backoff
+        self._next_attempt = time.time()
+
+
+    def _recover( self ) :
+        """ reconnect ( if it is time to try ) and send everything from the spool """
+
+        if not self._connected :
+
+            if time.time() < self._next_attempt :
+                return
+
+            try :
+                self._reconnect()
+            except self._broken + ( internal.Eggog, ), e :
+                # ( an 'F' to BeginSession, a failed sync or a late response fail the attempt just the same ;
+                #   the new socket is closed, the next attempt starts over )
+                self._disconnect()
+                self._backoff = min( 2 * self._backoff, self._max_backoff )
+                self._next_attempt = time.time() + self._backoff
+                return
+
+            self._connected = True
+            self._backoff = self._min_backoff
+
+        while len( self._spool ) :
+
+            packet = self._spool.peek()
+            packet.future = self._spooled_futures[0]
+
+            try :
+                ret = self._process( packet )
+            except self._broken, e :
+                self._lost( e )
+                return
+
+            # ( a command refused by the server is done as well : nothing to retry )
+            self._spool.pop()
+            self._spooled_futures.popleft()
+            self._report( packet, ret )
+
+
+    def _reconnect( self ) :
+        """ a new connection, a new session ( recording again, if it was ) and a new time reference """
+
+        self._disconnect()
+
+        self._netstation_object.connect( *self._address )
+        self._netstation_object.BeginSession()
+
+        # ( the spooled markers must not go to an amplifier that has stopped recording )
+        if self.recording :
+            self._netstation_object.StartRecording()
+
+        self._netstation_object.sync()
+
+        print " egi: reconnected, %d commands to send from the spool " % ( len( self._spool ), )
+
+
+    def _last_chance( self ) :
+        """ before stopping : one more attempt to empty the spool """
+
+        if self._spool is None or not len( self._spool ) :
+            return
+
+        self._next_attempt = 0
+        self._recover()
+
+        if len( self._spool ) :
+            print " egi: %d commands could not be sent, they are left in '%s' " % ( len( self._spool ), self._spool.path )
+
+            for future in self._spooled_futures :
+                future._finish( error = internal.ConnectionLost( "'%s' is left in the spool" % ( future.name, ) ) )
+
+
+    def close_spool( self ) :
+        """ once the thread has stopped : close the spool file ( removed if it is a temporary one and empty ) """
+
+        if self._spool is None :
+            return
+
+        left = len( self._spool )
+
+        # ( _last_chance() has told about it already if the thread has stopped as it should )
+        if not self._spool.close() and left and not self.finished :
+            print " egi: %d commands could not be sent, they are left in '%s' " % ( left, self._spool.path )
+
+    ## -----------------------------------------------------------
+
     # 
     # let's call the 'self._netstation_object.connect()' method directly     
     #
@@ -185,13 +1232,30 @@ class _NetstationThread( Thread ) :
     def connect( self, str_address, port_no ) :
         """ "forward" this method to the inner 'netstation' object """
 
-        return self._netstation_object.connect( str_address, port_no )     
+        self._address = ( str_address, port_no )
+
+        if self._spool is None :
+            return self._netstation_object.connect( str_address, port_no )     
+
+        # with a spool, an unreachable server is not fatal : the thread keeps trying
+        try :
+            self._netstation_object.connect( str_address, port_no )
+            self._connected = True
+        except socket.error, e :
+            self._lost( e )
         
     
     def _disconnect( self ) :
         """ this method is intended to be called internally and automatically ) """     
 
-        return self._netstation_object.disconnect(  )     
+        if self._spool is None :
+            return self._netstation_object.disconnect(  )     
+
+        # the connection may be broken ( or never made ) already
+        try :
+            self._netstation_object.disconnect()
+        except ( socket.error, AttributeError ) :
+            pass
         
     
 
@@ -209,16 +1273,56 @@ class _NetstationThread( Thread ) :
 
 class Netstation :     
 
-    """ Provides Python interface for a connection with the Netstation via a TCP/IP socket. """
+    """
+        Provides Python interface for a connection with the Netstation via a TCP/IP socket ;
+        the commands are queued, and each method returns a Request -- the future of its command .
+    """
 
     ## -----------------------------------------------------------
 
-    def __init__( self ) :
+    def __init__( self, reconnect = False, spool_path = None, sync_policy = None,
+                  capacity = None, overflow = 'block', put_timeout = None, spill_path = None, ring_size = None,
+                  on_error = None, keep_responses = 256, read_timeout = None, write_timeout = None, profile = 'default' ) :
+        """
+            with 'reconnect', a broken connection is restored in the background and
+            the commands are kept meanwhile in a spool file ( 'spool_path', a temporary file by default ) ;
+            finalize() removes the temporary spool ( and spill ) file if nothing is left in it -- otherwise
+            the file stays ( its path is printed ) ;
+            with a 'sync_policy' ( see clock.SyncPolicy ), sync() does nothing while the time reference is good enough ;
+            with a 'capacity', no more markers than that are queued -- the 'overflow' policy ( 'block' for up to
+            'put_timeout' seconds, 'drop-oldest' or 'spill' to 'spill_path' ) decides about the rest ( see _LaneQueue ) ;
+            with a 'ring_size', the commands go through a lock-free ring of that many slots instead ( see _Ring ) :
+            cheaper per command, but they must all come from one thread and are never reordered ;
+            'on_error( name, error )' is called by the 'postman' thread for every failed command ( the default
+            prints it ) ; only the last 'keep_responses' results are kept for enumerate_responses() ;
+            with a 'read_timeout', a response that has not come in time fails its command with ResponseTimeout
+            and the thread goes on ; a write stuck for 'write_timeout' breaks the connection ( see simple.WriteTimeout ) ;
+            the transport 'profile' is 'default', 'latency' ( no Nagle, small buffers ) or 'throughput'
+            ( the markers queued within a couple of ms go out as one write ), see socket_wrapper.PROFILES
+        """
+
+        if ring_size is None :
+            self._to_send = _LaneQueue( capacity, overflow, put_timeout, spill_path )
+        elif capacity is not None or overflow != 'block' :
+            raise ValueError( "the command ring is bounded by its size and blocks when full" )
+        else :
+            self._to_send = _Ring( ring_size, put_timeout )
+
+        self._to_receive = _Responses( keep_responses, on_error )
+
+        spool = None
+        if reconnect :
+            spool = Spool( spool_path )
+
+        self._netstation_thread = _NetstationThread( self._to_send, self._to_receive, spool )
+        self._netstation_thread._netstation_object.sync_policy = sync_policy
+        self._netstation_thread._netstation_object.set_timeouts( read_timeout, write_timeout )
 
-        self._to_send = Queue()
-        self._to_receive = Queue()     
+        settings = self._netstation_thread._netstation_object.set_profile( profile )
+        self._netstation_thread.coalesce = settings[ 'coalesce' ]
 
-        self._netstation_thread = _NetstationThread( self._to_send, self._to_receive )     
+        # used in the calling thread only ( for the event templates )
+        self._codec = internal._EventCodec()
 
     ## -----------------------------------------------------------
 
@@ -279,6 +1383,65 @@ class Netstation :
 
     ## -----------------------------------------------------------
 
+    #
+    # how well the marker transport keeps up ( see stats.py )
+    #
+
+    def queue_depth( self ) :
+        """ the number of the commands waiting to be sent ( queued or spooled ) """
+
+        depth = self._to_send.qsize()
+
+        spool = self._netstation_thread._spool
+        if spool is not None :
+            depth += len( spool )
+
+        return depth
+
+    def response_stats( self ) :
+        """ the results received so far : the counts, the last ( name, error ) and the unread ( name, result ) pairs """
+
+        return self._to_receive.summary()
+
+    def queue_stats( self ) :
+        """ the queue depth and the overflow counters ( the markers dropped, spilled to disk, refused ) """
+
+        queue = self._to_send
+
+        return { 'depth' : self.queue_depth(),
+                 'capacity' : queue.capacity,
+                 'overflow' : queue.overflow,
+                 'dropped' : queue.dropped,
+                 'spilled' : queue.spilled,
+                 'refused' : queue.refused }
+
+    def stats( self ) :
+        """ the latency statistics of the commands : the histograms, the error counts and the ring of the last stamps """
+
+        return self._netstation_thread.stats
+
+    def dump_stats( self, reset = True ) :
+        """ print the statistics ( e.g. at the end of a block ) and start over ; returns the summary printed """
+
+        stats = self._netstation_thread.stats
+
+        summary = stats.snapshot()
+        summary[ 'queue_depth' ] = self.queue_depth()
+        summary[ 'queue' ] = self.queue_stats()
+        summary[ 'profile' ] = self._netstation_thread._netstation_object.profile
+
+        print " egi: '%s' transport, " % ( summary[ 'profile' ], ) + stats.report( summary[ 'queue_depth' ] )
+
+        if summary[ 'queue' ][ 'capacity' ] is not None :
+            print "  queue  %(depth)d of %(capacity)d, '%(overflow)s' : %(dropped)d dropped, %(spilled)d spilled, %(refused)d refused" % summary[ 'queue' ]
+
+        if reset :
+            stats.reset()
+
+        return summary
+
+    ## -----------------------------------------------------------
+
     '''
     
     def _connect( self, str_address, port_no ):
@@ -312,21 +1475,41 @@ class Netstation :
         # return None     
 
     def finalize( self, seconds_timeout = 2 ) :
-        """ send the thread the 'Done' message and wait until it finishes """
+        """
+            send the thread the 'Done' message and wait until it finishes ( that is, until
+            the queue is empty and the socket is closed ), but no longer than 'seconds_timeout' ;
+            returns the number of the commands left unsent ( 0 when everything went fine )
+        """
 
         self._put( None )
 
-        t_start = time.time()
+        if self._ns_thread_is_running() :
+            self._netstation_thread.join( seconds_timeout )
 
-        # if the timeout termination will be of real use,
-        # we'll probably want to handle the exception in the 'postman' thread     
-        while ( time.time() - t_start ) < seconds_timeout :
+        self.process_responces()
             
-            self.process_responces()
+        # ( whatever the state of the thread : it may have died with the commands queued or spooled )
+        pending = self.queue_depth()
+
+        # the end marker is in the queue too, unless the thread has got to it already
+        if not self._netstation_thread.finished :
+            pending = max( 0, pending - 1 )
+
+        if self._ns_thread_is_running() :
+            print " egi: the thread has not finished in %s s, %d commands are still pending " % ( seconds_timeout, pending )
+        else :
+            if pending :
+                print " egi: the thread has stopped, %d commands are left unsent " % ( pending, )
+
+            # ( still in use while the thread is running )
+            self._netstation_thread.close_spool()
+            self._to_send.close()
 
         # debug
         print " egi: stopping ... "
 
+        return pending
+
         ## self._disconnect()     
 
 
@@ -339,12 +1522,16 @@ class Netstation :
         # return self._process( packet )
         self._put( packet )     
         
+        return packet.future
+        
 
     def EndSession( self ):
         """ say 'bye' to the server """
 
         packet = _Command( 'EndSession' )
         self._put( packet )     
+
+        return packet.future
         
         
     ## -----------------------------------------------------------
@@ -355,6 +1542,8 @@ class Netstation :
         packet = _Command( 'StartRecording' )     
         self._put( packet )     
 
+        return packet.future
+
 
     def StopRecording( self ):
         """ stop recording to the selected file;     
@@ -365,6 +1554,8 @@ class Netstation :
         packet = _Command( 'StopRecording' )     
         self._put( packet )     
 
+        return packet.future
+
     ## -----------------------------------------------------------
 
     #
@@ -380,29 +1571,53 @@ class Netstation :
         packet = _Command( 'SendAttentionCommand' )     
         self._put( packet )     
 
+        return packet.future
+
 
     def _SendLocalTime( self, ms_time = None ):
         """ Send the local time (in ms) to Netstation; usually this happens after an 'Attention' command """     
 
-        packet = _Command( 'SendAttentionCommand', { 'ms_time' : ms_time } )     
+        packet = _Command( 'SendLocalTime', { 'ms_time' : ms_time } )     
         self._put( packet )     
+
+        return packet.future
         
     ## -----------------------------------------------------------
 
-    def sync( self, timestamp = None ) :
-        """ a shortcut for sending the 'attention' command and the time info """
+    def sync( self, timestamp = None, rounds = None, force = False ) :
+        """
+            a shortcut for sending the 'attention' command and the time info ( see egi.simple.Netstation.sync() ) ;
+            to be sure the time reference is in place before going on :  ns.sync().result( timeout = 1.0 ) ;
+            a sync still waiting in the queue takes the place of this one
+        """
 
         # in the simplest form ,
         # we just send the instructions ( and hope they won't be delayed too much ) ;     
-        # though it might be a good idea to wait for the reponse here     
+        # the returned future lets the caller wait for the reponse when it matters     
         
         ## self.SendAttentionCommand()
         ## self.SendLocalTime( timestamp )
 
-        # TODO/todo : change the code so that we'll wait for the result in the calling thread     
+        packet = _Command( 'sync', { 'timestamp' : timestamp, 'rounds' : rounds, 'force' : force } )
+        packet = self._to_send.put( packet )     
 
-        packet = _Command( 'sync', { 'timestamp' : timestamp } )     
-        self._put( packet )     
+        return packet.future
+
+
+    def capture( self, path ) :
+        """ journal all the traffic to the given file ( see journal.py ) ; None stops capturing """
+
+        # goes through the queue : the socket belongs to the 'postman' thread
+        packet = _Command( 'capture', { 'path' : path } )
+        self._put( packet )
+
+        return packet.future
+
+
+    def sync_info( self ) :
+        """ the estimate of the last measured sync ( see egi.simple.Netstation._measured_sync() ), or None """
+
+        return self._netstation_thread._netstation_object.last_sync
     
     ## -----------------------------------------------------------
 
@@ -419,7 +1634,8 @@ class Netstation :
                               note that the "clock" used to produce the timestamp should be the same
                               as for the sync() method, and, ideally,
                               should be obtained via a call to the same function ;
-                              if 'timestamp' is None, a time.time() wrapper is used .
+                              if 'timestamp' is None, the current ms_localtime() is taken
+                          ( here, so a spooled event keeps the time it has happened ) .
             -- 'label' -- a string with any additional information, up to 256 characters .     
             -- 'description' -- more additional information can go here ( same limit applies ) .
             -- 'table' -- a standart Python dictionary, where keys are 4-byte identifiers,
@@ -435,6 +1651,9 @@ class Netstation :
         """     
         
         
+        if timestamp is None :
+            timestamp = ms_localtime()
+        
         kwargs = {                             \
                    'key'         : key         ,
                    'timestamp'   : timestamp   ,
@@ -447,7 +1666,61 @@ class Netstation :
         packet = _Command( 'send_event', kwargs )     
         self._put( packet )     
         
+        return packet.future
+        
     
+    def send_events( self, events ) :
+        """
+            Send several events at once ( see egi.simple.Netstation.send_events() ) ;
+            the whole batch is queued as one command ; the missing timestamps are taken now .
+        """
+
+        now = None
+        stamped = []
+
+        for e in events :
+
+            if isinstance( e, dict ) :
+                if e.get( 'timestamp' ) is None :
+                    if now is None : now = ms_localtime()
+                    e = dict( e, timestamp = now )
+
+            elif len( e ) < 2 or e[1] is None :
+                if now is None : now = ms_localtime()
+                e = ( e[0], now ) + tuple( e[2:] )
+
+            stamped.append( e )
+
+        packet = _Command( 'send_events', { 'events' : stamped } )
+        self._put( packet )
+
+        return packet.future
+
+
+    def event_template( self, key, label = None, description = None, table = None, pad = False ) :
+        """
+            Pre-encode an event to be sent with send_template() ;
+            the encoding happens here, in the calling thread, once .
+        """
+
+        return internal.EventTemplate( key, label, description, table, pad, self._codec )
+
+
+    def send_template( self, template, timestamp = None ) :
+        """
+            Send a pre-encoded event ( see event_template() ) ;
+            the timestamp is taken now ( if not given ) and patched in by the 'postman' thread .
+        """
+
+        if timestamp is None :
+            timestamp = ms_localtime()
+
+        packet = _Command( 'send_template', { 'template' : template, 'timestamp' : timestamp } )
+        self._put( packet )
+
+        return packet.future
+
+
     ## -----------------------------------------------------------
 
 
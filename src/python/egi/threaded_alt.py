@@ -25,6 +25,7 @@ from socket_wrapper import Socket
 
 Error = internal.Eggog     
 ms_localtime = internal.ms_localtime     
+marker_clock = internal.marker_clock
 
 #
 # the name(s) to be used internally     
@@ -32,9 +33,7 @@ ms_localtime = internal.ms_localtime
 
 ## _Netstation = internal.Netstation     
 
-import types # MethodType, FunctionType
-## import inspect # .ismethod()     
-from StringIO import StringIO     
+import inspect # getargspec()     
 
 # -----------------------------------------------------------------------------
 
@@ -62,12 +61,13 @@ class _Command :
 
     # (1) " packing " :     
 
-    def __init__( self, method_name, kwargs = None ) :
+    def __init__( self, method_name, kwargs = None, args = () ) :
 
         if kwargs is None :  kwargs = {}     
 
         self._func_name = method_name     
         self._kwargs = kwargs
+        self._args = args # the positional ones, passed as they are
 
     # (2) " unpacking " :     
 
@@ -84,7 +84,7 @@ class _Command :
     # (3) " helper method " :     
 
     @staticmethod
-    def call( obj, attrname, kwargs ) :
+    def call( obj, attrname, kwargs, args = () ) :
         """ call the given method with the arguments specified """
 
         '''     
@@ -100,13 +100,13 @@ class _Command :
         # it is better not to eat exceptions here     
 
         bound = getattr( obj, attrname )     
-        return bound( **kwargs )     
+        return bound( *args, **kwargs )     
         
 
     def invoke( self, obj ) :
         """ invoke the 'attrname' with 'kwargs' (both stored here) on the object 'obj' """     
 
-        return self.call( obj, self.name(), self.kwargs() )
+        return self.call( obj, self.name(), self.kwargs(), self._args )
         
     
         
@@ -201,6 +201,82 @@ class _NetstationThread( Thread ) :
         
     
 
+# -----------------------------------------------------------------------------
+
+#
+# the command stubs of the Netstation class below
+#
+
+# name -> ( the argument names without 'self', the number of the required ones ) ; filled on demand
+_signatures = {}
+
+def _is_command( name ) :
+    """ is it a public method of the internal Netstation ( to be wrapped into a command ) ? """
+
+    if name.startswith( '_' ) or name not in internal.Netstation.__dict__ :
+        return False
+
+    return callable( getattr( internal.Netstation, name ) )
+
+
+def _signature( name ) :
+
+    try :
+        return _signatures[ name ]
+    except KeyError :
+        pass
+
+    names, varargs, varkw, defaults = inspect.getargspec( getattr( internal.Netstation, name ) )
+
+    names = tuple( names[ 1 : ] )
+    n_required = len( names ) - len( defaults or () )
+
+    _signatures[ name ] = names, n_required
+
+    return names, n_required
+
+
+def _command_stub( name ) :
+    """
+        the method that queues the command 'name' ; the arguments go as they are ( bound by
+        the internal method in the 'postman' thread ), but are checked against its signature here
+    """
+
+    names, n_required = _signature( name )
+    n_names = len( names )
+
+    allowed = frozenset( names )
+
+    def stub( self, *args, **kwargs ) :
+
+        n_args = len( args )
+
+        if n_args > n_names :
+            raise TypeError( "%s() takes at most %d arguments (%d given)" % ( name, n_names, n_args ) )
+
+        if kwargs :
+
+            if not allowed.issuperset( kwargs ) :
+                raise TypeError( "%s() got an unexpected keyword argument among %s" % ( name, ", ".join( kwargs ) ) )
+
+            if n_args :
+                for n in names[ : n_args ] :
+                    if n in kwargs :
+                        raise TypeError( "%s() got multiple values for the argument '%s'" % ( name, n ) )
+
+        if n_args < n_required :
+            for n in names[ n_args : n_required ] :
+                if n not in kwargs :
+                    raise TypeError( "%s() takes at least %d arguments ( '%s' is missing )" % ( name, n_required, n ) )
+
+        self._to_send.put( _Command( name, kwargs, args ) )
+
+    stub.__name__ = name
+    stub.__doc__ = getattr( internal.Netstation, name ).__doc__
+
+    return stub
+    
+
 # -----------------------------------------------------------------------------
 
 #
@@ -226,6 +302,9 @@ class Netstation :
 
         self._netstation_thread = _NetstationThread( self._to_send, self._to_receive )     
 
+        # used in the calling thread only ( for the event templates )
+        self._codec = internal._EventCodec()
+
     ## -----------------------------------------------------------
 
     def _put( self, data ) :
@@ -340,177 +419,59 @@ class Netstation :
 
         # del _netstation_thread  
 
-    ## -----------------------------------------------------------     
     ## -----------------------------------------------------------
 
-    # 
-    # may be at some moment we should replace the repetitive code below
-    # to a getattr()-based code (alternatives: (a) "on-the-fly patching",
-    # (b) metaclasses, (c) exec statement and may be more ; )
-    # 
-    # (a) "static is better than dynamic" in the terms of execution cost ;
-    # (b) "simple is better than complex" )     
-    # (c) "explicit is better than implicit" -- i.e. "it is better to have clear syntax highlighting"     
-    #
-    # // finally preferred the exec way for the sake of easy ipython usage )     
-
-    # don't pollute the namespace too much     
-    local_names = locals().keys()     
-
-    from fwhelper import FunctionWrappingHelper as FWH
+    def sync_info( self ) :
+        """ the estimate of the last measured sync ( see egi.simple.Netstation._measured_sync() ), or None """
 
-    # a shortcut     
-    _NS = internal.Netstation     
+        return self._netstation_thread._netstation_object.last_sync
 
-    ## for name, value in _Netstation.__dict__.iteritems() :
-    for name in _NS.__dict__.iterkeys() :
-        
-        value = getattr( _NS, name )     
-        
-        ## # debug     
-        ## print name, value, type(value), \
-        ##       callable(value), isinstance(value, (types.FunctionType, types.MethodType) ), \
-        ##       inspect.ismethod(value)
-        
-        if name.startswith('_') : continue
-        '''     
-        if type(value) is not types.FunctionType \
-        and type(value) is not types.St : continue
-        '''     
-        ## if not isinstance(value, (types.FunctionType, types.MethodType)) : continue     
-        if not callable( value ) : continue     
+    #
+    # these two are written by hand : the template has to be encoded in the calling thread ,
+    # and the timestamp has to be taken at the moment of the call, not when the command is processed
+    #
 
-        # do not want to replace any of the existing names
-        ## could actually have "forwarded" names from a predefined list
+    def event_template( self, key, label = None, description = None, table = None, pad = False ) :
+        """ pre-encode an event to be sent with send_template() """
 
-        if name in local_names : continue     
+        return internal.EventTemplate( key, label, description, table, pad, self._codec )
 
-        #
-        # simple form of what we want to simulate goes below     
-        #
+    def send_template( self, template, timestamp = None ) :
+        """ send a pre-encoded event ( see event_template() ) """
 
-        '''
-        def BeginSession( self ) :     
-            """ say 'hi!' to the server """     
+        if timestamp is None :
+            timestamp = ms_localtime()
 
-            packet = _Command( 'BeginSession' )
-            # return self._process( packet )
-            self._put( packet )
-            
-        '''
+        packet = _Command( 'send_template', { 'template' : template, 'timestamp' : timestamp } )
+        self._put( packet )
 
-        #
-        # a more complicated xample of the internal code :     
-        #
+    ## -----------------------------------------------------------     
+    ## -----------------------------------------------------------
 
-        '''
-        
-        kwargs = {                             \
-                   'key'         : key         ,
-                   'timestamp'   : timestamp   ,
-                   'label'       : label       ,
-                   'description' : description ,
-                   'table'       : table       ,
-                   'pad'         : pad         \
-                }     
+    # 
+    # the rest of the commands are the public methods of the internal Netstation class ;
+    # instead of generating the wrappers at the import time ( with exec ), a plain
+    # Python stub is built on the first use of a name and kept in the class, so it
+    # is found by the normal attribute lookup from then on ( see _command_stub() )
+    # 
 
-        packet = _Command( 'send_event', kwargs )     
-        self._put( packet )     
+    def __getattr__( self, name ) :
+        """ build, keep and return the stub for a command of the internal Netstation """
 
-        '''     
+        if not _is_command( name ) :
+            raise AttributeError( name )
 
-        # else : ## start generating the call     
-        
-        fwh = FWH( value )
+        setattr( self.__class__, name, _command_stub( name ) )
 
-        # 
-        # the declaration
-        # 
+        return getattr( self, name )
         
-        header = StringIO()     
-        header.write('def %s( ' % ( name, ) )
-        for entry in fwh.enum_argentries( b_all = True) :
-
-            ## if entry == 'self' : continue     
-            header.write('%s, ' % (entry, ) )     
-            
-
-        header.write(' ):\n')
-        # "a bit of pretty-printing"     
-        header.write('\n')
-
-        header = header.getvalue()     
-
-        # 
-        # the helpstring     
-        # 
-
-        helpstr = getattr( value, '__doc__', None )
-
-        # 
-        # the call
-        # 
-
-        call = StringIO()
-
-        # put the helpstring 
-        if helpstr : call.write( '"""%s"""\n\n' % ( helpstr, ) )     
-
-        if fwh.nargs() > 1 :  # do we have "non-self" arguments ?     
-
-            call.write('kwargs = {' )
-            # at the moment we do not pass 'kwargs through kwargs' ( " { ... , '*kwargs' : kwargs } " ? kwargs_old.update( kwargs_new ) ?  )     
-            for entry in fwh.enum_argentries( b_no_default_values = True, b_all = False ) :
-
-                if entry == 'self' : continue     
-                call.write( "'%s' : %s, " % ( entry, entry ) )     
-
-            call.write(' }\n')
-
-            # "a bit of pretty-printing"     
-            call.write('\n')
-            
-            call.write("packet = _Command( '%s', kwargs )\n" % (name) )
-
-        else :  # no non-trivial arguments present
-            
-            call.write("packet = _Command( '%s' )\n" % (name) )
-
-        call.write("self._put( packet ) \n" )
-        # "a bit of pretty-printing"     
-        call.write('\n')
-
-        call.seek(0)
-
-        # indent     
-
-        call_ = StringIO()
-        for line in call.readlines() :
-            call_.write( '\t' + line )
-        call_.write('\n')     
-
-        call_ = call_.getvalue()     
-
-        code = header + call_
-        exec code     
-
-        ## # debug
-        ## print code     
-
-        # clean things
-        # # probably should check locals(), add the name-s, then clean all the rest     
+    def __dir__( self ) :
+        """ the commands not used yet are listed too ( for ipython and the like ) """
         
-        ## del code, line, call_, call, entry, header, fwh, value, name     
-        ## del code, line, call_, call, header ## fwh, value, name
-
-        local_names.append( name )
+        names = set( dir( self.__class__ ) ) | set( self.__dict__ )
+        names.update( name for name in internal.Netstation.__dict__ if _is_command( name ) )
         
-    # del code, line, call_, call, entry, header, fwh, value, name
-    extended_ = locals().keys()
-    # here 'v' stands for "var", not for "vendetta"
-    delete_ = [ v for v in extended_ if v not in local_names ]
-    for v in delete_ : exec "del %s" % ( v, )
-    del delete_, v     
+        return sorted( names )
     
 
     '''     
@@ -604,7 +565,8 @@ class Netstation :
                               note that the "clock" used to produce the timestamp should be the same
                               as for the sync() method, and, ideally,
                               should be obtained via a call to the same function ;
-                              if 'timestamp' is None, a time.time() wrapper is used .
+                              if 'timestamp' is None, ms_localtime() is taken -- the marker clock
+                              ( monotonic, see clock.MarkerClock ) sync() uses as well .
             -- 'label' -- a string with any additional information, up to 256 characters .     
             -- 'description' -- more additional information can go here ( same limit applies ) .
             -- 'table' -- a standart Python dictionary, where keys are 4-byte identifiers,
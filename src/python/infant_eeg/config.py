@@ -10,6 +10,19 @@ config.read(os.path.join(CONF_DIR, 'config.properties'))
 MONITOR = config.get('display', 'monitor')
 SCREEN = int(config.get('display', 'screen'))
 NETSTATION_IP = config.get('config', 'netstation_ip')
+# the transport profile of the marker connection (see egi.socket_wrapper.PROFILES)
+NETSTATION_PROFILE = 'default'
+if config.has_option('config', 'netstation_profile'):
+    NETSTATION_PROFILE = config.get('config', 'netstation_profile')
+
+# where the experiment events go (see infant_eeg.event_bus.SINKS)
+EVENT_SINKS = ['netstation', 'tobii']
+if config.has_option('events', 'sinks'):
+    EVENT_SINKS = [x.strip() for x in config.get('events', 'sinks').split(',')]
+EVENT_UDP_ADDRESS = ('127.0.0.1', 5005)
+if config.has_option('events', 'udp_address'):
+    host, port = config.get('events', 'udp_address').split(':')
+    EVENT_UDP_ADDRESS = (host, int(port))
 
 EYETRACKER_NAME = config.get('eyetracker', 'name')
 EYETRACKER_CALIBRATION_POINTS = []
@@ -0,0 +1,280 @@
+import os
+import socket
+from Queue import Queue, Full
+from threading import Thread
+from infant_eeg.config import EVENT_UDP_ADDRESS
+
+
+class Sink:
+    """
+    A destination of the experiment events. prepare() runs in the thread that publishes the event (the frame loop), so
+    it must be cheap; handle(), flush(), sync() and close() run in the sink's own worker thread.
+    """
+    name = 'sink'
+    # events (and flush/sync requests) waiting for the worker before new ones are dropped
+    buffer_size = 1000
+
+    def prepare(self, event):
+        """
+        Called when the event is published - returns what the worker gets to handle, or None if there is nothing left
+        to do
+        """
+        return event
+
+    def handle(self, event):
+        pass
+
+    def flush(self):
+        """
+        Pass on whatever the sink holds (end of trial / block)
+        """
+        pass
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NetstationSink(Sink):
+    """
+    Netstation markers - held until the next flush and then sent in one batch, so they go out in the inter-trial interval
+    """
+    name = 'netstation'
+
+    def __init__(self, ns):
+        self.ns = ns
+        self.held = []
+        self.refused = 0
+
+    def handle(self, event):
+        self.held.append((event.code, event.timestamp, event.label, None, event.table))
+
+    def flush(self):
+        if len(self.held):
+            future = self.ns.send_events(self.held)
+            # (the multiprocess connection returns no future - its errors only go to on_error)
+            if future is not None:
+                codes = [held[0] for held in self.held]
+                future.add_done_callback(lambda request: self.check(codes, request))
+            self.held = []
+
+    def check(self, codes, request):
+        """
+        Report the markers of the batch Netstation has not accepted - called by the netstation thread when the batch is
+        done
+        """
+        results = request.exception()
+        if results is None:
+            results = request.result()
+        else:
+            results = [results] * len(codes)
+        for code, result in zip(codes, results):
+            if isinstance(result, Exception):
+                self.refused += 1
+                print('Netstation has not accepted event %s: %s' % (code, result))
+
+    def sync(self):
+        self.ns.sync()
+
+
+class TobiiSink(Sink):
+    """
+    Events in the eyetracker data file - the eyetracker time has to be read when the event happens, so the whole work is
+    done in prepare() and the worker has nothing to do
+    """
+    name = 'tobii'
+
+    def __init__(self, eye_tracker):
+        self.eye_tracker = eye_tracker
+
+    def prepare(self, event):
+        self.eye_tracker.recordEvent(event)
+        return None
+
+
+class JournalSink(Sink):
+    """
+    A local, tab separated log of the events: timestamp, code, label, table
+    """
+    name = 'journal'
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+
+    def handle(self, event):
+        table = ''
+        if event.table is not None:
+            table = ','.join(['%s=%s' % (key, value) for key, value in sorted(event.table.items())])
+        self.file.write('%d\t%s\t%s\t%s\n' % (event.timestamp, event.code, event.label, table))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class UdpSink(Sink):
+    """
+    One datagram per event (timestamp, code and label, tab separated) - for monitoring the experiment from another
+    process or machine
+    """
+    name = 'udp'
+
+    def __init__(self, address):
+        self.address = address
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def handle(self, event):
+        try:
+            self.socket.sendto('%d\t%s\t%s' % (event.timestamp, event.code, event.label), self.address)
+        except socket.error:
+            # nobody listening
+            pass
+
+    def close(self):
+        self.socket.close()
+
+
+class _Worker(Thread):
+    """
+    The thread (and queue) of a single sink
+    """
+
+    def __init__(self, sink):
+        Thread.__init__(self, name='%s events' % sink.name)
+        self.daemon = True
+        self.sink = sink
+        self.queue = Queue(sink.buffer_size)
+        self.published = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except Full:
+            if not self.dropped:
+                print('Event sink %s is falling behind, dropping its events' % self.sink.name)
+            self.dropped += 1
+            return False
+
+    def run(self):
+        while True:
+            request, event = self.queue.get()
+            try:
+                if request == 'event':
+                    self.sink.handle(event)
+                elif request == 'flush':
+                    self.sink.flush()
+                elif request == 'sync':
+                    self.sink.sync()
+                else:
+                    self.sink.flush()
+                    self.sink.close()
+                    return
+            except Exception, e:
+                if not self.failed:
+                    print('Event sink %s failed: %s' % (self.sink.name, e))
+                self.failed += 1
+
+
+class EventBus:
+    """
+    Publishes the experiment events to every sink. Each sink has its own worker thread and queue, so a slow sink delays
+    neither the others nor the frame - when its queue is full, it loses the event instead
+    """
+
+    def __init__(self, sinks=()):
+        self.workers = []
+        for sink in sinks:
+            self.add_sink(sink)
+
+    def add_sink(self, sink):
+        worker = _Worker(sink)
+        worker.start()
+        self.workers.append(worker)
+
+    def publish(self, event):
+        for worker in self.workers:
+            item = worker.sink.prepare(event)
+            if item is not None and worker.put(('event', item)):
+                worker.published += 1
+
+    def flush(self):
+        for worker in self.workers:
+            worker.put(('flush', None))
+
+    def sync(self):
+        for worker in self.workers:
+            worker.put(('sync', None))
+
+    def close(self, timeout=5.0):
+        """
+        Flush and close every sink, waiting up to timeout seconds for each of them - a sink whose queue stays full that
+        long does not get to close and counts as failed
+        """
+        closing = []
+        for worker in self.workers:
+            try:
+                worker.queue.put(('close', None), timeout=timeout)
+                closing.append(worker)
+            except Full:
+                worker.failed += 1
+                print('Event sink %s is stuck, not closed' % worker.sink.name)
+        for worker in self.workers:
+            if worker in closing:
+                worker.join(timeout)
+            if worker.dropped or worker.failed:
+                print('Event sink %s: %d events, %d dropped, %d failed' % (worker.sink.name, worker.published,
+                                                                         worker.dropped, worker.failed))
+        self.workers = []
+
+
+def netstation_sink(experiment):
+    if experiment.ns is not None:
+        return NetstationSink(experiment.ns)
+
+
+def tobii_sink(experiment):
+    if experiment.eye_tracker is not None:
+        return TobiiSink(experiment.eye_tracker)
+
+
+def journal_sink(experiment):
+    return JournalSink(os.path.splitext(experiment.logfile)[0] + '_events.log')
+
+
+def udp_sink(experiment):
+    return UdpSink(EVENT_UDP_ADDRESS)
+
+
+# sink name (as in the sinks option of [events] in config.properties) -> factory taking the experiment and returning the sink,
+# or None if the experiment has nothing for it
+SINKS = {
+    'netstation': netstation_sink,
+    'tobii': tobii_sink,
+    'journal': journal_sink,
+    'udp': udp_sink,
+}
+
+
+def register_sink(name, factory):
+    SINKS[name] = factory
+
+
+def build_bus(experiment, names):
+    """
+    Create the event bus of the experiment with the named sinks
+    """
+    bus = EventBus()
+    for name in names:
+        if name not in SINKS:
+            raise ValueError('Unknown event sink: %s' % name)
+        sink = SINKS[name](experiment)
+        if sink is not None:
+            bus.add_sink(sink)
+    return bus
@@ -16,6 +16,7 @@ try:
 except:
     pass
 from infant_eeg.distractors import DistractorSet
+from infant_eeg.event_bus import build_bus
 from infant_eeg.config import *
 
 
@@ -77,7 +78,12 @@ class Experiment:
         self.ns = None
         if exp_info['eeg']:
             # connect to netstation
-            self.ns = egi.Netstation()
+            # keep the markers in a spool file and reconnect if the connection breaks;
+            # the per-trial syncs only go out when the time reference needs refreshing;
+            # if Netstation stalls, the backlog of markers goes to disk instead of memory;
+            # an acknowledgement later than a second fails its marker instead of holding up the rest
+            self.ns = egi.Netstation(reconnect=True, sync_policy=egi.SyncPolicy(), capacity=1000, overflow='spill',
+                                     read_timeout=1.0, write_timeout=2.0, profile=NETSTATION_PROFILE)
             ms_localtime = egi.ms_localtime
 
         self.eye_tracker = None
@@ -155,14 +161,14 @@ class Experiment:
                 print('Could not connect with NetStation!')
 
         # Initialize logging
-        logfile = os.path.join(DATA_DIR, 'logs', self.exp_info['experiment'], '%s_%s_%s.log' % (self.exp_info['child_id'],
-                                                                                                self.exp_info['date'],
-                                                                                                self.exp_info['session']))
+        self.logfile = os.path.join(DATA_DIR, 'logs', self.exp_info['experiment'], '%s_%s_%s.log' % (self.exp_info['child_id'],
+                                                                                                     self.exp_info['date'],
+                                                                                                     self.exp_info['session']))
 
         if self.eye_tracker is not None:
-            self.eye_tracker.setDataFile(logfile, self.exp_info)
+            self.eye_tracker.setDataFile(self.logfile, self.exp_info)
         else:
-            datafile = open(logfile, 'w')
+            datafile = open(self.logfile, 'w')
             datafile.write('Recording date:\t' + datetime.datetime.now().strftime('%Y/%m/%d') + '\n')
             datafile.write('Recording time:\t' + datetime.datetime.now().strftime('%H:%M:%S') + '\n')
             datafile.write('Recording resolution\t%d x %d\n' % tuple(self.win.size))
@@ -170,6 +176,9 @@ class Experiment:
                 datafile.write('%s:\t%s\n' % (key, data))
             datafile.close()
 
+        # Experiment events go to netstation, the eyetracker data file, etc. through the event bus
+        self.events = build_bus(self, EVENT_SINKS)
+
         # Create random block order
         n_repeats = int(self.num_blocks/len(self.blocks.keys()))
         for i in range(n_repeats):
@@ -188,6 +197,9 @@ class Experiment:
         """
         Disconnect from eyetracker and netstation
         """
+        # pass on the last events before the connections go
+        self.events.close()
+
         if self.eye_tracker is not None:
             self.eye_tracker.stopTracking()
             self.eye_tracker.closeDataFile()
@@ -206,7 +218,6 @@ class Experiment:
     def run(self):
         """
         Run task
-        ns - netstation connection
         """
         pass
 
@@ -47,7 +47,7 @@ class GazeFollowingExperiment(Experiment):
             # clear any keystrokes before starting
             event.clearEvents()
 
-            self.preferential_gaze.run(self.ns, self.eye_tracker, self.mouse, self.gaze_debug, self.debug_sq)
+            self.preferential_gaze.run(self.events, self.eye_tracker, self.mouse, self.gaze_debug, self.debug_sq)
 
             # Check user input
             all_keys = event.getKeys()
@@ -85,7 +85,7 @@ class GazeFollowingExperiment(Experiment):
                 self.distractor_set.show_video()
 
                 # Run block
-                resp=self.blocks[block_name].run(self.ns, self.eye_tracker, self.mouse, self.gaze_debug,
+                resp=self.blocks[block_name].run(self.events, self.eye_tracker, self.mouse, self.gaze_debug,
                                                  self.distractor_set, self.debug_sq)
                 if len(resp):
                     # Quit experiment
@@ -100,6 +100,10 @@ class GazeFollowingExperiment(Experiment):
                 if self.eye_tracker is not None:
                     self.eye_tracker.flushData()
 
+                # Report how the marker transport kept up during the block
+                if self.ns is not None:
+                    self.ns.dump_stats()
+
         # Run preferential gaze trials
         if cont and self.exp_info['preferential gaze']:
             self.run_preferential_gaze()
@@ -268,24 +272,20 @@ class Trial:
             'shuf': self.shuffled,
             'actr': str(self.actor)
         }
-        self.events=[]
 
-    def add_event(self, ns, eye_tracker, code, label, table):
-        trial_event=Event(code, label, table)
-        self.events.append(trial_event)
-        if eye_tracker is not None:
-            eye_tracker.recordEvent(trial_event)
+    def add_event(self, events, code, label, table):
+        events.publish(Event(code, label, table))
 
-    def show_init_video(self, ns, eyetracker, mouse, gaze_debug):
-        self.win.callOnFlip(self.add_event, ns, eyetracker, 'imov', 'init movie', self.code_table)
+    def show_init_video(self, events, eyetracker, mouse, gaze_debug):
+        self.win.callOnFlip(self.add_event, events, 'imov', 'init movie', self.code_table)
         while not self.init_video_stim.stim.status == visual.FINISHED:
             self.init_video_stim.stim.draw()
             draw_eye_debug(gaze_debug, eyetracker, mouse)
             self.win.flip()
 
-    def show_init_stimulus(self, ns, eyetracker, mouse, gaze_debug, debug_sq):
+    def show_init_stimulus(self, events, eyetracker, mouse, gaze_debug, debug_sq):
         # Show two stimuli and initial frame of movie
-        self.win.callOnFlip(self.add_event, ns, eyetracker, 'ima1', 'stim start', self.code_table)
+        self.win.callOnFlip(self.add_event, events, 'ima1', 'stim start', self.code_table)
         for i in range(self.init_stim_frames):
             self.init_frame.draw()
             for image in self.images.values():
@@ -295,14 +295,14 @@ class Trial:
                 debug_sq.draw()
             self.win.flip()
 
-    def highlight_peripheral_stimulus_gaze(self, ns, eyetracker, mouse, gaze_debug):
+    def highlight_peripheral_stimulus_gaze(self, events, eyetracker, mouse, gaze_debug):
         # Set which stimulus to highlight
         self.highlight.pos = self.images[self.attention].pos
         # Show initial frame of video until highlighted stimulus if fixated on or abort
         attending_frames = 0
         highlight_on = False
         idx = 0
-        self.win.callOnFlip(self.add_event, ns, eyetracker, 'ima2', 'attn start', self.code_table)
+        self.win.callOnFlip(self.add_event, events, 'ima2', 'attn start', self.code_table)
         while attending_frames < self.min_attending_frames and idx < self.max_attending_frames:
             # Draw init frame of movie and two stimuli
             self.init_frame.draw()
@@ -349,7 +349,7 @@ class Trial:
                     gaze_debug.fillColor = (-1, -1, 1)
                 attending_frames += 1
                 if attending_frames == 1:
-                    self.win.callOnFlip(self.add_event, ns, eyetracker, 'att1', 'attn stim', self.code_table)
+                    self.win.callOnFlip(self.add_event, events, 'att1', 'attn stim', self.code_table)
             else:
                 if gaze_debug is not None:
                     gaze_debug.fillColor = (1, -1, -1)
@@ -359,7 +359,7 @@ class Trial:
 
         return attending_frames
 
-    def highlight_peripheral_stimulus_click(self, ns, eyetracker, mouse, gaze_debug):
+    def highlight_peripheral_stimulus_click(self, events, eyetracker, mouse, gaze_debug):
         # Set which stimulus to highlight
         self.highlight.pos = self.images[self.attention].pos
 
@@ -369,7 +369,7 @@ class Trial:
         highlight_on = False
         idx = 0
         attending_frames = 0
-        self.win.callOnFlip(self.add_event, ns, eyetracker, 'ima2', 'attn start', self.code_table)
+        self.win.callOnFlip(self.add_event, events, 'ima2', 'attn start', self.code_table)
         while resp is None and idx < self.max_attending_frames:
             # Draw init frame of movie and two stimuli
             self.init_frame.draw()
@@ -416,7 +416,7 @@ class Trial:
                     gaze_debug.fillColor = (-1, -1, 1)
                 attending_frames += 1
                 if attending_frames == 1:
-                    self.win.callOnFlip(self.add_event, ns, eyetracker, 'att1', 'attn stim', self.code_table)
+                    self.win.callOnFlip(self.add_event, events, 'att1', 'attn stim', self.code_table)
             else:
                 if gaze_debug is not None:
                     gaze_debug.fillColor = (1, -1, -1)
@@ -444,12 +444,12 @@ class Trial:
 
         return None
 
-    def play_movie(self, ns, eyetracker, mouse, gaze_debug):
+    def play_movie(self, events, eyetracker, mouse, gaze_debug):
         self.images['l'].pos = [-self.peripheral_offset, 0]
         self.images['r'].pos = [self.peripheral_offset, 0]
 
         # Play movie
-        self.win.callOnFlip(self.add_event, ns, eyetracker, 'mov1', 'movie start', self.code_table)
+        self.win.callOnFlip(self.add_event, events, 'mov1', 'movie start', self.code_table)
 
         attending_frames = 0
         while not self.video_stim.stim.status == visual.FINISHED:
@@ -477,17 +477,17 @@ class Trial:
                     gaze_debug.fillColor = (-1, -1, 1)
                 attending_frames += 1
                 if attending_frames == 1:
-                    self.win.callOnFlip(self.add_event, ns, eyetracker, 'att2', 'attn face', self.code_table)
+                    self.win.callOnFlip(self.add_event, events, 'att2', 'attn face', self.code_table)
             else:
                 if gaze_debug is not None:
                     gaze_debug.fillColor = (1, -1, -1)
         if gaze_debug is not None:
             gaze_debug.fillColor = (1, -1, -1)
 
-    def run(self, ns, eyetracker, mouse, gaze_debug, debug_sq):
+    def run(self, events, eyetracker, mouse, gaze_debug, debug_sq):
         """
         Run trial
-        :param ns - connection to netstation
+        :param events - experiment event bus
         :param eyetracker - connection to eyetracker
         :param mouse - mouse
         """
@@ -496,23 +496,21 @@ class Trial:
         self.init_video_stim.reload(self.win)
         self.video_stim.reload(self.win)
 
-        self.show_init_video(ns, eyetracker, mouse, gaze_debug)
+        self.show_init_video(events, eyetracker, mouse, gaze_debug)
 
-        self.show_init_stimulus(ns, eyetracker, mouse, gaze_debug, debug_sq)
+        self.show_init_stimulus(events, eyetracker, mouse, gaze_debug, debug_sq)
 
-        # attending_frames = self.highlight_peripheral_stimulus_gaze(ns, eyetracker, mouse, gaze_debug)
+        # attending_frames = self.highlight_peripheral_stimulus_gaze(events, eyetracker, mouse, gaze_debug)
         #
         # if attending_frames >= self.min_attending_frames:
-        #     self.play_movie(ns, eyetracker, mouse, gaze_debug)
-        cmd=self.highlight_peripheral_stimulus_click(ns, eyetracker, mouse, gaze_debug)
+        #     self.play_movie(events, eyetracker, mouse, gaze_debug)
+        cmd=self.highlight_peripheral_stimulus_click(events, eyetracker, mouse, gaze_debug)
 
         if cmd is None:
-            self.play_movie(ns, eyetracker, mouse, gaze_debug)
+            self.play_movie(events, eyetracker, mouse, gaze_debug)
 
-        for trial_event in self.events:
-            if ns is not None:
-                ns.send_event(trial_event.code, label=trial_event.label, timestamp=trial_event.timestamp, table=trial_event.table)
-        self.events=[]
+        # pass on the events of the trial
+        events.flush()
 
         return cmd
 
@@ -545,10 +543,10 @@ class Block:
         self.win.flip()
         event.waitKeys()
 
-    def run(self, ns, eyetracker, mouse, gaze_debug, distractor_set, debug_sq):
+    def run(self, events, eyetracker, mouse, gaze_debug, distractor_set, debug_sq):
         """
         Run the block
-        :param ns - connection to netstation
+        :param events - experiment event bus
         :return True if task should continue, False if should quit
         """
 
@@ -562,13 +560,12 @@ class Block:
         np.random.shuffle(trial_order)
 
         # Start netstation recording
-        send_event(ns, eyetracker, 'blk1', "block start", {'code': self.code})
+        send_event(events, 'blk1', "block start", {'code': self.code})
 
         # Run trials
         for t in range(self.num_trials):
             # Synch with netstation in between trials
-            if ns is not None:
-                ns.sync()
+            events.sync()
 
             # Compute random delay period
             delay_frames = self.min_iti_frames + int(np.random.rand() * (self.max_iti_frames - self.min_iti_frames))
@@ -578,7 +575,7 @@ class Block:
 
             # Run trial
             trial_idx = trial_order[t]
-            cmd=self.trials[trial_idx].run(ns, eyetracker, mouse, gaze_debug, debug_sq)
+            cmd=self.trials[trial_idx].run(events, eyetracker, mouse, gaze_debug, debug_sq)
 
             # Check user input
             all_keys = event.getKeys()
@@ -611,7 +608,7 @@ class Block:
                 self.win.flip()
 
         # Stop netstation recording
-        send_event(ns, eyetracker, 'blk2', 'block end', {'code': self.code})
+        send_event(events, 'blk2', 'block end', {'code': self.code})
         return []
 
 
@@ -656,10 +653,10 @@ class PreferentialGaze:
         self.right_roi.lineWidth = 10
         self.attn_video=MovieStimulus(self.win, '', '', 'attn.mpg', attn_video_size)
 
-    def run(self, ns, eyetracker, mouse, gaze_debug, debug_sq):
+    def run(self, events, eyetracker, mouse, gaze_debug, debug_sq):
         """
         Run trial
-        :param ns: netstation connection
+        :param events: experiment event bus
         :param eyetracker: eyetracker
         :return:
         """
@@ -682,7 +679,7 @@ class PreferentialGaze:
         mouse.clickReset()
         resp=None
         self.attn_video.reload(self.win)
-        self.win.callOnFlip(send_event, ns, eyetracker, 'pgat', 'pg attn', {'left': left_actor, 'rght': right_actor})
+        self.win.callOnFlip(send_event, events, 'pgat', 'pg attn', {'left': left_actor, 'rght': right_actor})
         while resp is None:
             while not self.attn_video.stim.status == visual.FINISHED and resp is None:
                 self.attn_video.stim.draw()
@@ -695,7 +692,7 @@ class PreferentialGaze:
             self.attn_video.reload(self.win)
 
         # Draw images
-        self.win.callOnFlip(send_event, ns, eyetracker, 'pgst', 'pg start', {'left': left_actor, 'rght': right_actor})
+        self.win.callOnFlip(send_event, events, 'pgst', 'pg start', {'left': left_actor, 'rght': right_actor})
         for i in range(self.duration_frames):
             for actor in self.actors:
                 actor.stim.draw()
@@ -706,4 +703,4 @@ class PreferentialGaze:
             if debug_sq is not None:
                 debug_sq.draw()
             self.win.flip()
-        send_event(ns, eyetracker, 'pgen', "pg end", {'left': left_actor, 'rght': right_actor})
+        send_event(events, 'pgen', "pg end", {'left': left_actor, 'rght': right_actor})
@@ -30,7 +30,7 @@ class NineMonthFacialMovementExperiment(Experiment):
             self.distractor_set.show_video()
 
             # Run block
-            resp=self.blocks[block_name].run(self.ns, self.eye_tracker, self.mouse, self.gaze_debug,
+            resp=self.blocks[block_name].run(self.events, self.eye_tracker, self.mouse, self.gaze_debug,
                                              self.distractor_set, self.debug_sq, last_block_code_order,
                                              last_block_movement_order)
 
@@ -49,6 +49,10 @@ class NineMonthFacialMovementExperiment(Experiment):
             if self.eye_tracker is not None:
                 self.eye_tracker.flushData()
 
+            # Report how the marker transport kept up during the block
+            if self.ns is not None:
+                self.ns.dump_stats()
+
         self.close()
 
     def read_xml(self, file_name):
@@ -132,7 +136,6 @@ class Block:
         self.movement_repeats=movement_repeats
         self.movie_stimuli = []
         self.init_frames=[]
-        self.trial_events=[]
 
 
     def pause(self):
@@ -144,11 +147,8 @@ class Block:
         event.waitKeys()
 
 
-    def add_trial_event(self, ns, eye_tracker, code, label, table):
-        trial_event=Event(code, label, table)
-        self.trial_events.append(trial_event)
-        if eye_tracker is not None:
-            eye_tracker.recordEvent(trial_event)
+    def add_trial_event(self, events, code, label, table):
+        events.publish(Event(code, label, table))
 
 
     def is_valid_trial_order(self, last_block_code_order, last_block_movement_order):
@@ -201,11 +201,11 @@ class Block:
         return True
 
 
-    def run(self, ns, eyetracker, mouse, gaze_debug, distractor_set, debug_sq, last_block_code_order,
+    def run(self, events, eyetracker, mouse, gaze_debug, distractor_set, debug_sq, last_block_code_order,
             last_block_movement_order):
         """
         Run the block
-        :param ns: connection to netstation
+        :param events: experiment event bus
         :param eyetracker: connection to eyetracker
         :returns True if task should continue, False if should quit
         """
@@ -223,7 +223,7 @@ class Block:
             valid=self.is_valid_trial_order(last_block_code_order, last_block_movement_order)
 
         # Start netstation recording
-        send_event(ns, eyetracker, 'blk1', "block start", {'code': self.code})
+        send_event(events, 'blk1', "block start", {'code': self.code})
 
         # Compute random delay period
         iti_frames = self.min_iti_frames+int(np.random.rand()*(self.max_iti_frames-self.min_iti_frames))
@@ -235,8 +235,7 @@ class Block:
         for t in range(self.trials):
 
             # Synch with netstation in between trials
-            if ns is not None:
-                ns.sync()
+            events.sync()
 
             # Compute random delay period
             iti_frames = self.min_iti_frames+int(np.random.rand()*(self.max_iti_frames-self.min_iti_frames))
@@ -252,7 +251,7 @@ class Block:
             event.clearEvents()
 
             # Show initial frame
-            self.win.callOnFlip(self.add_trial_event, ns, eyetracker, 'ima1', 'initial frame',
+            self.win.callOnFlip(self.add_trial_event, events, 'ima1', 'initial frame',
                                 {'code': self.movie_stimuli[video_idx].code,
                                  'mvmt': self.movie_stimuli[video_idx].movement,
                                  'actr': self.movie_stimuli[video_idx].actor})
@@ -264,7 +263,7 @@ class Block:
                 self.win.flip()
 
             # Play movie
-            self.win.callOnFlip(self.add_trial_event, ns, eyetracker, 'mov1', 'movie start',
+            self.win.callOnFlip(self.add_trial_event, events, 'mov1', 'movie start',
                                 {'code': self.movie_stimuli[video_idx].code,
                                  'mvmt': self.movie_stimuli[video_idx].movement,
                                  'actr': self.movie_stimuli[video_idx].actor})
@@ -276,16 +275,14 @@ class Block:
                 self.win.flip()
 
             # Tell netstation the movie has stopped
-            self.add_trial_event(ns, eyetracker, 'mov2', 'movie end', {})
+            self.add_trial_event(events, 'mov2', 'movie end', {})
 
             # Black screen for delay
             for i in range(iti_frames):
                 self.win.flip()
 
-            for trial_event in self.trial_events:
-                if ns is not None:
-                    ns.send_event(trial_event.code, label=trial_event.label, timestamp=trial_event.timestamp, table=trial_event.table)
-            self.trial_events=[]
+            # pass on the events of the trial
+            events.flush()
 
             # Check user input
             all_keys = event.getKeys()
@@ -309,5 +306,5 @@ class Block:
                 event.clearEvents()
 
         # Stop netstation recording
-        send_event(ns, eyetracker, 'blk2', 'block end', {'code': self.code})
+        send_event(events, 'blk2', 'block end', {'code': self.code})
         return []
\ No newline at end of file